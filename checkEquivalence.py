@@ -0,0 +1,425 @@
+import os
+import re
+import math
+import random
+import argparse
+import tempfile
+
+from parallelReplay import parallel_replay_log
+from phaseEnergy import attribute_runs, cached_discovery_savings
+from powerModel import compute_energy, log_power
+from replayKernel import encode_log, log_times, read_log, replay, replay_log
+from wurSimulator import USING_CACHE, WUR_FULL_DISCOVERY, expand_events, simulate, write_log
+
+# Regression check of the compiled replay. Simulates aow, dcw and dcb runs,
+# writes their state logs and asserts that
+#
+#   - the table-driven replay gives the times and sleep periods of the original
+#     per-scenario parse_log_file functions (frozen copies below),
+#   - log_power charges each event like the original calculate_power loop
+#     against a synthetic capture of the log's packets,
+#   - compressed IdleRun runs account exactly like their expanded events,
+#   - the parallel chunked replay equals the sequential one, and
+#   - the per-phase attribution sums to the scenario_energy totals, and
+#   - the cached discovery savings equal the energy of the same run with every
+#     cached discovery replaced by a full one.
+#
+#   python checkEquivalence.py --time-limit 20000 --seeds 3
+
+SCENARIOS = ('aow', 'dcw', 'dcb')
+TIME_LIMIT = 5000
+SEEDS = 2
+CHUNK_SIZE = 4096   # Small chunks so the parallel replay has many boundaries to stitch
+PROCESSES = 2
+REL_TOL = 1e-9
+
+
+def reference_parse_aow(log_file_path):
+    # parse_log_file of the original aow_powerCompute.py
+    events = []
+    WuR_times = {'active': 0, 'listening': 0, 'sleep': 0}
+    BLE_times = {'transmit': 0, 'receive': 0, 'idle': 0}
+    ble_sleep_periods = []
+
+    previous_time = None
+    previous_event = None
+    ble_asleep = True
+    ble_sleep_start = 0
+    WuR_state = 'listening'
+    with open(log_file_path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line.startswith("Time"):
+                try:
+                    parts = line.split(": ", 1)
+                    time_sec = int(parts[0].split()[1].replace('s', ''))
+                    description = parts[1].strip()
+                    events.append((time_sec, description))
+
+                    if previous_time is not None:
+                        duration = time_sec - previous_time
+                        if WuR_state == 'listening':
+                            WuR_times['listening'] += duration
+                        elif WuR_state == 'active':
+                            WuR_times['active'] += duration
+
+                        if 'Wake-up radio is checking for a signal' in description:
+                            WuR_state = 'listening'
+                            if not ble_asleep:
+                                ble_asleep = True
+                                ble_sleep_start = time_sec
+                        elif 'BLE device is now awake and communicating' in description:
+                            WuR_state = 'sleep'
+                            if ble_asleep:
+                                ble_asleep = False
+                                ble_sleep_periods.append((ble_sleep_start, time_sec))
+                        elif 'Wake-up signal detected' in description:
+                            WuR_state = 'active'
+
+                        if 'transmitting' in previous_event:
+                            BLE_times['transmit'] += duration
+                        elif 'receiving' in previous_event:
+                            BLE_times['receive'] += duration
+                        else:
+                            BLE_times['idle'] += duration
+
+                    previous_time = time_sec
+                    previous_event = description
+                except (IndexError, ValueError):
+                    continue
+
+    if ble_asleep:
+        ble_sleep_periods.append((ble_sleep_start, previous_time))
+    return events, WuR_times, BLE_times, ble_sleep_periods
+
+
+def reference_parse_dcw(log_file_path):
+    # parse_log_file of the original dcw_powerCompute.py
+    events = []
+    WuR_times = {'active': 0, 'listening': 0, 'sleep': 0}
+    BLE_times = {'transmit': 0, 'receive': 0, 'idle': 0}
+    ble_sleep_periods = []
+
+    previous_time = None
+    previous_event = None
+    ble_asleep = True
+    ble_sleep_start = 0
+    WuR_state = 'listening'
+    with open(log_file_path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line.startswith("Time"):
+                try:
+                    parts = line.split(": ", 1)
+                    time_sec = int(parts[0].split()[1].replace('s', ''))
+                    description = parts[1].strip()
+                    events.append((time_sec, description))
+
+                    if previous_time is not None:
+                        duration = time_sec - previous_time
+                        if WuR_state == 'listening':
+                            WuR_times['listening'] += duration
+                        elif WuR_state == 'sleep':
+                            WuR_times['sleep'] += duration
+                        elif WuR_state == 'active':
+                            WuR_times['active'] += duration
+
+                        if 'Wake-up radio is awake and checking for a signal' in description:
+                            WuR_state = 'listening'
+                        elif 'No wake-up signal detected' in description and WuR_state == 'listening':
+                            pass
+                        elif 'Wake-up radio is going back to sleep' in description:
+                            WuR_state = 'sleep'
+                        elif 'BLE device is now awake and communicating' in description:
+                            if WuR_state != 'sleep':
+                                WuR_state = 'sleep'
+                        elif 'Wake-up signal detected' in description:
+                            WuR_state = 'active'
+
+                        if ble_asleep and 'BLE device is now awake' in description:
+                            ble_asleep = False
+                            ble_sleep_periods.append((ble_sleep_start, time_sec))
+                        elif 'Putting BLE device back to sleep' in description:
+                            ble_asleep = True
+                            ble_sleep_start = time_sec
+
+                        if 'transmitting' in previous_event:
+                            BLE_times['transmit'] += duration
+                        elif 'receiving' in previous_event:
+                            BLE_times['receive'] += duration
+                        else:
+                            BLE_times['idle'] += duration
+
+                    previous_time = time_sec
+                    previous_event = description
+                except (IndexError, ValueError):
+                    continue
+
+    if ble_asleep:
+        ble_sleep_periods.append((ble_sleep_start, previous_time))
+    return events, WuR_times, BLE_times, ble_sleep_periods
+
+
+def reference_parse_dcb(log_file_path):
+    # parse_log_file of the original dcb_powerCompute.py, without the sleep power
+    events = []
+    BLE_times = {'transmit': 0, 'receive': 0, 'idle': 0}
+    ble_sleep_phases = 0
+
+    previous_time = None
+    with open(log_file_path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line.startswith("Time"):
+                try:
+                    parts = line.split(": ", 1)
+                    time_sec = float(parts[0].split()[1].replace('s', ''))
+                    description = parts[1].strip()
+                    events.append((time_sec, description))
+
+                    if 'Putting BLE device back to sleep after notification.' in description:
+                        ble_sleep_phases += 1
+
+                    if previous_time is not None:
+                        duration = time_sec - previous_time
+                        if 'transmitting' in description:
+                            BLE_times['transmit'] += duration
+                        elif 'receiving' in description:
+                            BLE_times['receive'] += duration
+                        else:
+                            BLE_times['idle'] += duration
+
+                    previous_time = time_sec
+                except (IndexError, ValueError):
+                    continue
+
+    return events, BLE_times, ble_sleep_phases
+
+
+# PACKET_MAPPING_REGEX of the original scripts (aow and dcw spelled out 'advertising', dcb 'advertisement')
+REFERENCE_PACKETS = {
+    re.compile(r"advertising indication", re.IGNORECASE): 19,
+    re.compile(r"advertisement indication", re.IGNORECASE): 19,
+    re.compile(r"connection indication", re.IGNORECASE): 39,
+    re.compile(r"service discovery request", re.IGNORECASE): 20,
+    re.compile(r"transmitting service discovery", re.IGNORECASE): 21,
+    re.compile(r"receiving characteristic discovery request", re.IGNORECASE): 20,
+    re.compile(r"transmitting characteristic discovery", re.IGNORECASE): 22,
+    re.compile(r"receiving all available characteristic descriptors request", re.IGNORECASE): 18,
+    re.compile(r"transmitting characteristic descriptor discovery", re.IGNORECASE): 19,
+    re.compile(r"enable notification request", re.IGNORECASE): 18,
+    re.compile(r"enable notifications response", re.IGNORECASE): 14,
+    re.compile(r"heart rate measurement notification", re.IGNORECASE): 22
+}
+
+
+def reference_calculate_power(log_events, packet_lengths, N_channels, t_comm, skipped=None):
+    # BLE part of calculate_power of the original scripts; dcb skips its wake-up events
+    power_times = {}
+    total_power_BLE = 0
+    power_per_packet = {}
+
+    packet_counter = 1
+    for time_sec, desc in log_events:
+        power = 0
+        packet_length = packet_lengths.get(packet_counter, None)
+        matched = None
+        for regex, expected_length in REFERENCE_PACKETS.items():
+            if regex.search(desc) and (packet_length and abs(packet_length - expected_length) <= 2):
+                matched = packet_length
+                break
+
+        if skipped is not None and skipped in desc:
+            continue
+
+        if matched:
+            if 'transmitting' in desc:
+                power = (3.4e-3 * matched * N_channels * 3.0) / t_comm
+            elif 'receiving' in desc:
+                power = (3.7e-3 * matched * N_channels * 3.0) / t_comm
+            total_power_BLE += power
+            power_per_packet[time_sec] = power
+            packet_counter += 1
+        else:
+            power = 1.5e-6 * 3.0
+            total_power_BLE += power
+
+        power_times[time_sec] = power
+
+    return power_times, total_power_BLE, power_per_packet
+
+
+def synthetic_capture(log_events, seed, skipped=None):
+    """
+    Packet lengths of a capture of the log: each packet event's expected length
+    off by up to 2 bytes, except one packet three quarters of the way through
+    that is off by 3, where matching stalls for the rest of the log. Events
+    containing skipped are not packets.
+    """
+    rng = random.Random(seed)
+    expected = [next(length for regex, length in REFERENCE_PACKETS.items() if regex.search(desc))
+                for _, desc in log_events if any(regex.search(desc) for regex in REFERENCE_PACKETS)
+                and (skipped is None or skipped not in desc)]
+    lengths = [length + rng.randint(-2, 2) for length in expected]
+    if lengths:
+        stall = 3 * len(lengths) // 4
+        lengths[stall] = expected[stall] + rng.choice((-3, 3))
+    return {number: length for number, length in enumerate(lengths, 1)}
+
+
+def _check_close(label, actual, expected):
+    if isinstance(expected, dict):
+        if set(actual) != set(expected):
+            raise AssertionError(f"{label}: keys {sorted(actual)} != {sorted(expected)}")
+        for key in expected:
+            _check_close(f"{label}[{key!r}]", actual[key], expected[key])
+    elif not math.isclose(actual, expected, rel_tol=REL_TOL, abs_tol=REL_TOL):
+        raise AssertionError(f"{label}: {actual!r} != {expected!r}")
+
+
+def check_reference_parser(scenario, log_file_path):
+    """
+    Table replay against the original parse_log_file of the scenario.
+    """
+    ticks, codes, encoder = encode_log(log_file_path)
+    result = replay(ticks, codes, encoder, scenario)
+    if scenario == 'dcb':
+        _, BLE_times, ble_sleep_phases = reference_parse_dcb(log_file_path)
+        _check_close(f"{scenario} BLE_times", result['activity_times'], BLE_times)
+        if result['fixed_sleep_phases'] != ble_sleep_phases:
+            raise AssertionError(f"{scenario} sleep phases: {result['fixed_sleep_phases']} != {ble_sleep_phases}")
+        return
+    reference = reference_parse_aow if scenario == 'aow' else reference_parse_dcw
+    _, WuR_times, BLE_times, ble_sleep_periods = reference(log_file_path)
+    times = log_times(result)
+    _check_close(f"{scenario} WuR_times", times[0], WuR_times)
+    _check_close(f"{scenario} BLE_times", times[1], BLE_times)
+    if [tuple(period) for period in times[2]] != ble_sleep_periods:
+        raise AssertionError(f"{scenario} ble_sleep_periods differ")
+
+
+def check_log_power(scenario, log_file_path, seed):
+    """
+    log_power against the original calculate_power loop, with a synthetic capture.
+    """
+    log_events = read_log(log_file_path)
+    skipped = 'BLE device is waking up to send heart rate measurement notification' if scenario == 'dcb' else None
+    packet_lengths = synthetic_capture(log_events, seed, skipped)
+    power = log_power(log_file_path, scenario, packet_lengths)
+    power_times, total_power_BLE, power_per_packet = reference_calculate_power(log_events, packet_lengths, 7, 10,
+                                                                               skipped)
+    _check_close(f"{scenario} power_times", power['power_times'], power_times)
+    _check_close(f"{scenario} power_per_packet", power['power_per_packet'], power_per_packet)
+    _check_close(f"{scenario} total_power_BLE", power['energy']['BLE'], total_power_BLE)
+    if not power_per_packet:
+        raise AssertionError(f"{scenario}: no packet of the synthetic capture was matched")
+
+
+def check_idle_runs(scenario, events, compressed_log, expanded_log):
+    """
+    Compressed IdleRun events and logs against their expanded form.
+    """
+    expanded = list(expand_events(events))
+    _check_close(f"{scenario} compute_energy", compute_energy(events, scenario), compute_energy(expanded, scenario))
+    compressed_result, compressed_power = replay_log(compressed_log, scenario)
+    expanded_result, expanded_power = replay_log(expanded_log, scenario)
+    if compressed_result != expanded_result:
+        raise AssertionError(f"{scenario}: compressed and expanded log replays differ")
+    _check_close(f"{scenario} total_power_BLE", compressed_power, expanded_power)
+
+    compressed_phases = attribute_runs([events], scenario)
+    expanded_phases = attribute_runs([expanded], scenario)
+    for key in ('energy', 'time', 'events', 'visits'):
+        if not (abs(compressed_phases[key] - expanded_phases[key]) <=
+                REL_TOL * (1 + abs(expanded_phases[key]))).all():
+            raise AssertionError(f"{scenario}: compressed and expanded phase {key} differ")
+
+
+def check_parallel_replay(scenario, log_file_path, processes=PROCESSES, chunk_size=CHUNK_SIZE):
+    """
+    Parallel chunked replay against the sequential replay of the same log.
+    """
+    ticks, codes, encoder = encode_log(log_file_path)
+    if parallel_replay_log(log_file_path, scenario, processes, chunk_size) != replay(ticks, codes, encoder, scenario):
+        raise AssertionError(f"{scenario}: parallel and sequential replays of {log_file_path} differ")
+
+
+def check_phase_totals(scenario, events):
+    """
+    Per-phase energy summed over phases against scenario_energy.
+    """
+    result = attribute_runs([events], scenario)
+    components = result['energy'][0].sum(axis=0)
+    attributed = {component: float(components[c]) for c, component in enumerate(result['components'])}
+    expected = compute_energy(events, scenario)
+    for key, value in expected.items():
+        if key != 'total':
+            _check_close(f"{scenario} phase total {key}", attributed.get(key, 0.0), value)
+    _check_close(f"{scenario} phase total", float(components.sum()), expected['total'])
+
+
+def uncached_events(events):
+    """
+    The events of a WuR run with every cached discovery replaced by the full
+    discovery it skipped, and everything after it delayed accordingly.
+    """
+    uncached = []
+    delay = 0
+    for time_sec, description in expand_events(events):
+        if description != USING_CACHE:
+            uncached.append((time_sec + delay, description))
+            continue
+        for elapsed, step in WUR_FULL_DISCOVERY:
+            delay += elapsed
+            if step is not None:
+                uncached.append((time_sec + delay, step))
+    return uncached
+
+
+def check_cached_discovery_savings(scenario, events):
+    """
+    cached_discovery_savings against the energy difference between the run
+    and its uncached counterpart.
+    """
+    savings = cached_discovery_savings(attribute_runs([events], scenario))['savings']
+    difference = compute_energy(uncached_events(events), scenario)['total'] - compute_energy(events, scenario)['total']
+    if not math.isclose(savings, difference, rel_tol=1e-6, abs_tol=1e-9):
+        raise AssertionError(f"{scenario}: cached discovery savings {savings!r} != uncached difference {difference!r}")
+
+
+def check_scenario(scenario, seed, time_limit, directory, processes=PROCESSES):
+    run = simulate(scenario, time_limit=time_limit, seed=seed, fast_forward=True)
+    events = run['events']
+    compressed_log = os.path.join(directory, f'{scenario}_{seed}_compressed.txt')
+    expanded_log = os.path.join(directory, f'{scenario}_{seed}_expanded.txt')
+    write_log(events, compressed_log)
+    write_log(list(expand_events(events)), expanded_log)
+
+    check_reference_parser(scenario, expanded_log)
+    check_log_power(scenario, expanded_log, seed)
+    check_idle_runs(scenario, events, compressed_log, expanded_log)
+    check_parallel_replay(scenario, expanded_log, processes)
+    check_parallel_replay(scenario, compressed_log, processes)
+    check_phase_totals(scenario, events)
+    check_cached_discovery_savings(scenario, events)
+
+
+def check_all(scenarios=SCENARIOS, seeds=SEEDS, time_limit=TIME_LIMIT, processes=PROCESSES):
+    """
+    Run every check for each scenario and seed; raises AssertionError on the first mismatch.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        for scenario in scenarios:
+            for seed in range(seeds):
+                check_scenario(scenario, seed, time_limit, directory, processes)
+                print(f"{scenario} seed {seed}: ok")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check the compiled replay against its reference paths.")
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS))
+    parser.add_argument('--seeds', type=int, default=SEEDS)
+    parser.add_argument('--time-limit', type=float, default=TIME_LIMIT)
+    parser.add_argument('--processes', type=int, default=PROCESSES)
+    args = parser.parse_args()
+    check_all(args.scenarios, args.seeds, args.time_limit, args.processes)
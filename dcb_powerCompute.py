@@ -1,76 +1,11 @@
+import os
 import pyshark
 import matplotlib.pyplot as plt
-import re
 import csv  
 
-# Constants for power consumption (in Amperes)
-POWER_PARAMS = {
-    'transmit': 3.4e-3,    # BLE transmit power
-    'receive': 3.7e-3,     # BLE receive power
-    'BLE_idle': 1.5e-6     # BLE idle/sleep power (1.5 µA)
-}
-
-V_OP = 3.0  # Coin battery voltage (Volts)
-
-SLEEP_DURATION = 10  # Fixed sleep duration of 10 seconds
-
-# Define a modified packet mapping with improved regex support for event descriptions
-PACKET_MAPPING_REGEX = {
-    re.compile(r"advertisement indication", re.IGNORECASE): ("LE LL", "Control Opcode: LL_CHANNEL_MAP_IND", 19),
-    re.compile(r"connection indication", re.IGNORECASE): ("LE LL", "Control Opcode: LL_CHANNEL_MAP_IND", 39),
-    re.compile(r"service discovery request", re.IGNORECASE): ("ATT", "Read By Group Type Request", 20),
-    re.compile(r"transmitting service discovery", re.IGNORECASE): ("ATT", "Read By Group Type Response", 21),
-    re.compile(r"receiving characteristic discovery request", re.IGNORECASE): ("ATT", "Read By Type Request", 20),
-    re.compile(r"transmitting characteristic discovery", re.IGNORECASE): ("ATT", "Read By Type Response", 22),
-    re.compile(r"receiving all available characteristic descriptors request", re.IGNORECASE): ("ATT", "Find Information Request", 18),
-    re.compile(r"transmitting characteristic descriptor discovery", re.IGNORECASE): ("ATT", "Find Information Response", 19),
-    re.compile(r"enable notification request", re.IGNORECASE): ("ATT", "Write Request", 18),
-    re.compile(r"enable notifications response", re.IGNORECASE): ("ATT", "Write Response", 14),
-    re.compile(r"heart rate measurement notification", re.IGNORECASE): ("ATT", "Handle Value Notification", 22)
-}
-
-# Parse the log file for BLE states with explicit time tracking and sleep power calculation
-def parse_log_file(log_file_path):
-    events = []
-    BLE_times = {'transmit': 0, 'receive': 0, 'idle': 0}
-    ble_sleep_phases = 0  # Count the number of sleep phases
-    ble_sleep_power_total = 0  # Track total sleep power
-
-    previous_time = None
-    with open(log_file_path, 'r') as file:
-        for line in file:
-            line = line.strip()
-            if line.startswith("Time"):
-                try:
-                    parts = line.split(": ", 1)
-                    time_sec = float(parts[0].split()[1].replace('s', ''))
-                    description = parts[1].strip()
-                    events.append((time_sec, description))
-
-                    if 'Putting BLE device back to sleep after notification.' in description:
-                        # Track the number of sleep phases
-                        ble_sleep_phases += 1
-                        # Calculate sleep power for each 10 second sleep phase
-                        sleep_power = SLEEP_DURATION * POWER_PARAMS['BLE_idle'] * 1e6  # µA
-                        ble_sleep_power_total += sleep_power
-
-                    if previous_time is not None:
-                        duration = time_sec - previous_time
-
-                        # BLE transmit and receive durations
-                        if 'transmitting' in description:
-                            BLE_times['transmit'] += duration
-                        elif 'receiving' in description:
-                            BLE_times['receive'] += duration
-                        else:
-                            BLE_times['idle'] += duration
-
-                    previous_time = time_sec
-
-                except (IndexError, ValueError):
-                    continue
-
-    return events, BLE_times, ble_sleep_phases, ble_sleep_power_total
+from powerModel import log_power
+from resultsStore import record_run
+from scenarioEngine import load_scenario
 
 def parse_pcap_file(pcap_file_path):
     """
@@ -87,51 +22,19 @@ def parse_pcap_file(pcap_file_path):
             continue
     return packet_lengths
 
-def match_event_to_packet(description, packet_lengths, packet_counter):
+def calculate_power(log_file_path, packet_lengths, N_channels, t_comm):
     """
-    Match the log event description to a BLE packet using regex for description matching and length.
+    Replay the log with the 'dcb' scenario (scenarios/dcb.json) and charge its
+    events; wake-up events are left uncharged. Returns the events, BLE_times,
+    the number of sleep phases, the BLE power over time and per packet, the
+    sleep power (µA) and the scenario_energy totals.
     """
-    packet_length = packet_lengths.get(packet_counter, None)
-    
-    # Check for matching event based on description and length
-    for regex, (protocol, operation, expected_length) in PACKET_MAPPING_REGEX.items():
-        if regex.search(description) and (packet_length and abs(packet_length - expected_length) <= 2):
-            return packet_length, protocol, operation
-    
-    return None, None, None
-
-def calculate_power(log_events, packet_lengths, N_channels, t_comm, BLE_times, ble_sleep_power_total):
-    power_times = {}
-    total_power_BLE = 0
-    power_per_packet = {}
-
-    packet_counter = 1  # Packet counter to track .pcap file
-
-    for i, event in enumerate(log_events):
-        time_sec, desc = event
-        power = 0
-        packet_length, protocol, operation = match_event_to_packet(desc, packet_lengths, packet_counter)
-
-        if 'BLE device is waking up to send heart rate measurement notification' in desc:
-            continue
-
-        if packet_length:
-            if 'transmitting' in desc:
-                # Include N_channels in the power calculation
-                power = (POWER_PARAMS['transmit'] * packet_length * N_channels * V_OP) / t_comm
-            elif 'receiving' in desc:
-                power = (POWER_PARAMS['receive'] * packet_length * N_channels * V_OP) / t_comm
-
-            total_power_BLE += power
-            power_per_packet[time_sec] = power
-            packet_counter += 1 if packet_length else 0
-        else:
-            power = POWER_PARAMS['BLE_idle'] * V_OP
-            total_power_BLE += power
-
-        power_times[time_sec] = power
-
-    return power_times, total_power_BLE, ble_sleep_power_total, power_per_packet
+    power = log_power(log_file_path, 'dcb', packet_lengths, N_channels, t_comm)
+    scenario = load_scenario('dcb')
+    # Fixed sleep phases are charged at the scenario's fixed_sleep current
+    ble_sleep_power_total = power['energy']['BLE_sleep'] / scenario.voltage * 1e6  # µA
+    return (power['events'], power['result']['activity_times'], power['result']['fixed_sleep_phases'],
+            power['power_times'], power['power_per_packet'], ble_sleep_power_total, power['energy'])
 
 
 def print_power_results(total_power_BLE, ble_sleep_phases, ble_sleep_power_total):
@@ -203,19 +106,27 @@ base_dir = os.path.dirname(os.path.abspath(__file__))
 log_file_path = os.path.join(base_dir, 'dcbstate_log.txt')
 pcap_file_path = os.path.join(base_dir, 'HeartRateImplant(2).pcap')
 
-log_events, BLE_times, ble_sleep_phases, ble_sleep_power_total = parse_log_file(log_file_path)
-packet_lengths = parse_pcap_file(pcap_file_path)
+scenario = load_scenario('dcb')
+N_channels = scenario.parameters['N_channels']
+t_comm = scenario.parameters['t_comm']
 
-t_comm = 10  # Communication time window (assumed value)
-N_channels = 7  # BLE default
+packet_lengths = parse_pcap_file(pcap_file_path)
 
-ble_power_times, total_power_BLE, ble_sleep_power_total, power_per_packet = calculate_power(
-    log_events, packet_lengths, N_channels, t_comm, BLE_times, ble_sleep_power_total
-)
+(log_events, BLE_times, ble_sleep_phases, ble_power_times, power_per_packet, ble_sleep_power_total,
+ energy) = calculate_power(log_file_path, packet_lengths, N_channels, t_comm)
+total_power_BLE = energy['BLE']
 
 csv_filename = os.path.join(base_dir, 'dutycycledble.csv')
 save_power_to_csv(csv_filename, ble_power_times, power_per_packet)
 
+# Record the run in the results database, with the scenario parameters it was charged with
+record_run('dcb', dict(scenario.parameters, N_channels=N_channels, t_comm=t_comm,
+                       sleep_duration=scenario.sleep_duration()), energy,
+           input_files=[log_file_path, pcap_file_path],
+           summary={'events': len(log_events), 'packets': len(power_per_packet),
+                    'ble_sleep_phases': ble_sleep_phases, 'BLE_times': BLE_times},
+           source='log')
+
 print_power_results(total_power_BLE, ble_sleep_phases, ble_sleep_power_total)
 debug_power_times(ble_power_times, power_per_packet)
 plot_power_consumption(ble_power_times, power_per_packet)
@@ -1,116 +1,12 @@
+import os
 import pyshark
 import matplotlib.pyplot as plt
 import csv
-import re
 
-# Constants for power consumption (in Amperes)
-POWER_PARAMS = {
-    'WuR_active': 5.3e-6,  # WuR active power
-    'WuR_listen': 2.7e-6,  # WuR listening power
-    'WuR_sleep': 0.4e-6,   # WuR sleep power
-    'transmit': 3.4e-3,    # BLE transmit power
-    'receive': 3.7e-3,     # BLE receive power
-    'BLE_idle': 1.5e-6     # BLE idle/sleep power
-}
-
-# Define a modified packet mapping with improved regex support for event descriptions
-PACKET_MAPPING_REGEX = {
-    re.compile(r"advertising indication", re.IGNORECASE): ("LE LL", "Control Opcode: LL_CHANNEL_MAP_IND", 19),
-    re.compile(r"connection indication", re.IGNORECASE): ("LE LL", "Control Opcode: LL_CHANNEL_MAP_IND", 39),
-    re.compile(r"service discovery request", re.IGNORECASE): ("ATT", "Read By Group Type Request", 20),
-    re.compile(r"transmitting service discovery", re.IGNORECASE): ("ATT", "Read By Group Type Response", 21),
-    re.compile(r"receiving characteristic discovery request", re.IGNORECASE): ("ATT", "Read By Type Request", 20),
-    re.compile(r"transmitting characteristic discovery", re.IGNORECASE): ("ATT", "Read By Type Response", 22),
-    re.compile(r"receiving all available characteristic descriptors request", re.IGNORECASE): ("ATT", "Find Information Request", 18),
-    re.compile(r"transmitting characteristic descriptor discovery", re.IGNORECASE): ("ATT", "Find Information Response", 19),
-    re.compile(r"enable notification request", re.IGNORECASE): ("ATT", "Write Request", 18),
-    re.compile(r"enable notifications response", re.IGNORECASE): ("ATT", "Write Response", 14),
-    re.compile(r"heart rate measurement notification", re.IGNORECASE): ("ATT", "Handle Value Notification", 22)
-}
-
-# Parse the log file for WuR and BLE states with explicit time tracking
-def parse_log_file(log_file_path):
-    events = []
-    WuR_times = {'active': 0, 'listening': 0, 'sleep': 0}
-    BLE_times = {'transmit': 0, 'receive': 0, 'idle': 0}
-    ble_sleep_periods = []
-
-    previous_time = None
-    previous_event = None
-    ble_asleep = True  # Start BLE in sleep state
-    ble_sleep_start = 0  # Start BLE sleep from the beginning
-    WuR_state = 'listening'  # Track current WuR state, start in listening mode
-    with open(log_file_path, 'r') as file:
-        for line in file:
-            line = line.strip()
-            if line.startswith("Time"):
-                try:
-                    parts = line.split(": ", 1)
-                    time_sec = int(parts[0].split()[1].replace('s', ''))
-                    description = parts[1].strip()
-                    events.append((time_sec, description))
-
-                    if previous_time is not None:
-                        duration = time_sec - previous_time
-
-                        # Update WuR times based on state transitions
-                        if WuR_state == 'listening':
-                            WuR_times['listening'] += duration
-                        elif WuR_state == 'sleep':
-                            WuR_times['sleep'] += duration
-                        elif WuR_state == 'active':
-                            WuR_times['active'] += duration
-
-                        # WuR state transitions using structured checks
-                        if 'Wake-up radio is awake and checking for a signal' in description:
-                            WuR_state = 'listening'
-
-                        # No wake-up signal detected still means WuR is in listening phase
-                        elif 'No wake-up signal detected' in description and WuR_state == 'listening':
-                            # Continue in the listening state
-                            pass
-
-                        # WuR goes back to sleep
-                        elif 'Wake-up radio is going back to sleep' in description:
-                            WuR_state = 'sleep'
-
-                        # BLE device is awake and communicating, WuR should transition to sleep
-                        elif 'BLE device is now awake and communicating' in description:
-                            if WuR_state != 'sleep':
-                                WuR_state = 'sleep'
-
-                        # WuR becomes active upon detecting a signal
-                        elif 'Wake-up signal detected' in description:
-                            WuR_state = 'active'
-
-                        # BLE device state transitions
-                        if ble_asleep and 'BLE device is now awake' in description:
-                            ble_asleep = False
-                            ble_sleep_periods.append((ble_sleep_start, time_sec))
-
-                        elif 'Putting BLE device back to sleep' in description:
-                            ble_asleep = True
-                            ble_sleep_start = time_sec
-
-                        # BLE transmit and receive durations
-                        if 'transmitting' in previous_event:
-                            BLE_times['transmit'] += duration
-                        elif 'receiving' in previous_event:
-                            BLE_times['receive'] += duration
-                        else:
-                            BLE_times['idle'] += duration
-
-                    previous_time = time_sec
-                    previous_event = description
-
-                except (IndexError, ValueError):
-                    continue
-
-    # If BLE is asleep at the end of the log, finalize the sleep period
-    if ble_asleep:
-        ble_sleep_periods.append((ble_sleep_start, previous_time))
-
-    return events, WuR_times, BLE_times, ble_sleep_periods
+from powerModel import log_power
+from replayKernel import log_times
+from resultsStore import record_run
+from scenarioEngine import load_scenario
 
 def parse_pcap_file(pcap_file_path):
     """
@@ -127,93 +23,18 @@ def parse_pcap_file(pcap_file_path):
             continue
     return packet_lengths
 
-def match_event_to_packet(description, packet_lengths, packet_counter):
-    """
-    Match the log event description to a BLE packet using regex for description matching and length.
-    """
-    packet_length = packet_lengths.get(packet_counter, None)
-    
-    # Check for matching event based on description and length
-    for regex, (protocol, operation, expected_length) in PACKET_MAPPING_REGEX.items():
-        if regex.search(description) and (packet_length and abs(packet_length - expected_length) <= 2):
-            return packet_length, protocol, operation
-    
-    return None, None, None
-
-def calculate_power(log_events, packet_lengths, N_channels, t_comm, WuR_times, ble_sleep_periods):
+def calculate_power(log_file_path, packet_lengths, N_channels, t_comm):
     """
-    Calculate the power consumption dynamically by mapping events to packets in .pcap.
+    Replay the log with the 'dcw' scenario (scenarios/dcw.json) and charge its
+    events. Returns the events, WuR_times, BLE_times, ble_sleep_periods, the BLE
+    power and WuR current (µA) over time, the BLE power per packet and the
+    scenario_energy totals.
     """
-    power_times = {}
-    WuR_power_times = {}
-    total_power_WuR = 0
-    total_power_BLE = 0
-    total_ble_sleep_power = 0
-    power_per_packet = {}
-
-    V_OP = 3.0  # Operational voltage (3V for BLE)
-
-    # Calculate WuR power consumption
-    total_power_WuR = (WuR_times['active'] * POWER_PARAMS['WuR_active'] +
-                       WuR_times['listening'] * POWER_PARAMS['WuR_listen'] +
-                       WuR_times['sleep'] * POWER_PARAMS['WuR_sleep']) * V_OP  # Multiply by operational voltage
-
-    current_wur_power = POWER_PARAMS['WuR_listen']  # Start WuR in listening state
-
-    # BLE awake tracking
-    ble_awake_start_time = None
-    ble_awake_end_time = None
-    packet_counter = 1  # Packet counter to track .pcap file
-
-    for i, event in enumerate(log_events):
-        time_sec, desc = event
-        power = 0
-        packet_length, protocol, operation = match_event_to_packet(desc, packet_lengths, packet_counter)
-
-        # Debugging information to check packet mapping
-        print(f"Packet counter: {packet_counter}, Packet length: {packet_length}")
-
-        # WuR State Transitions
-        if 'Wake-up signal detected' in desc:
-            current_wur_power = POWER_PARAMS['WuR_active']  # WuR active
-        elif 'BLE device is now awake and communicating' in desc:
-            current_wur_power = POWER_PARAMS['WuR_sleep']  # WuR sleep
-        elif 'Wake-up radio is awake and checking for a signal' in desc:
-            current_wur_power = POWER_PARAMS['WuR_listen']  # WuR listening
-        elif 'Wake-up radio is going back to sleep' in desc:
-            current_wur_power = POWER_PARAMS['WuR_sleep']  # WuR sleep
-
-        # Record WuR power over time in microamps for plotting
-        WuR_power_times[time_sec] = current_wur_power * 1e6
-
-        # Calculate BLE power consumption
-        if packet_length:
-            if 'transmitting' in desc:
-                # BLE transmit power considering operational voltage, number of channels, and packet length
-                power = (POWER_PARAMS['transmit'] * packet_length * N_channels * V_OP) / t_comm
-            elif 'receiving' in desc:
-                # BLE receive power considering operational voltage, number of channels, and packet length
-                power = (POWER_PARAMS['receive'] * packet_length * N_channels * V_OP) / t_comm
-
-            total_power_BLE += power
-            power_per_packet[time_sec] = power
-
-            # Only increment packet counter if a match was found
-            packet_counter += 1 if packet_length else 0
-        else:
-            # Default BLE idle power considering operational voltage
-            power = POWER_PARAMS['BLE_idle'] * V_OP
-            total_power_BLE += power
-        
-        power_times[time_sec] = power
-
-    # Handle BLE Sleep Periods and calculate BLE sleep power
-    for start_time, end_time in ble_sleep_periods:
-        sleep_duration = end_time - start_time
-        total_ble_sleep_power += sleep_duration * POWER_PARAMS['BLE_idle'] * V_OP  # BLE sleep power with voltage
-
-    return power_times, WuR_power_times, total_power_WuR, total_power_BLE, total_ble_sleep_power, power_per_packet
-
+    power = log_power(log_file_path, 'dcw', packet_lengths, N_channels, t_comm)
+    WuR_times, BLE_times, ble_sleep_periods = log_times(power['result'])
+    WuR_power_times = {time_sec: current * 1e6 for time_sec, current in power['current_times']['WuR'].items()}
+    return (power['events'], WuR_times, BLE_times, ble_sleep_periods, power['power_times'], WuR_power_times,
+            power['power_per_packet'], power['energy'])
 
 # Function to print power results
 def print_power_results(total_power_WuR, total_power_BLE, total_ble_sleep_power):
@@ -310,19 +131,27 @@ base_dir = os.path.dirname(os.path.abspath(__file__))
 log_file_path = os.path.join(base_dir, 'state_log.txt')
 pcap_file_path = os.path.join(base_dir, 'HeartRateImplant.pcap')
 
-N_channels = 7
-t_comm = 10  # Example communication time
+scenario = load_scenario('dcw')
+N_channels = scenario.parameters['N_channels']
+t_comm = scenario.parameters['t_comm']
 
-log_events, WuR_times, BLE_times, ble_sleep_periods = parse_log_file(log_file_path)
 packet_lengths = parse_pcap_file(pcap_file_path)
 
-ble_power_times, wur_power_times, total_power_WuR, total_power_BLE, total_ble_sleep_power, power_per_packet = calculate_power(
-    log_events, packet_lengths, N_channels, t_comm, WuR_times, ble_sleep_periods)
+(log_events, WuR_times, BLE_times, ble_sleep_periods, ble_power_times, wur_power_times, power_per_packet,
+ energy) = calculate_power(log_file_path, packet_lengths, N_channels, t_comm)
+total_power_WuR, total_power_BLE, total_ble_sleep_power = energy['WuR'], energy['BLE'], energy['BLE_sleep']
 
 # Save power consumption data to CSV
 csv_filename = os.path.join(base_dir, 'dutycycledwur.csv')
 save_power_to_csv(csv_filename, ble_power_times, wur_power_times, power_per_packet)
 
+# Record the run in the results database, with the scenario parameters it was charged with
+record_run('dcw', dict(scenario.parameters, N_channels=N_channels, t_comm=t_comm), energy,
+           input_files=[log_file_path, pcap_file_path],
+           summary={'events': len(log_events), 'packets': len(power_per_packet),
+                    'ble_sleep_periods': len(ble_sleep_periods), 'WuR_times': WuR_times, 'BLE_times': BLE_times},
+           source='log')
+
 # Debug the power times dictionaries
 debug_power_times(ble_power_times, wur_power_times, power_per_packet)
 
@@ -331,7 +160,3 @@ print_power_results(total_power_WuR, total_power_BLE, total_ble_sleep_power)
 
 # Plot the integrated BLE and WuR power consumption graphs
 plot_power_consumption(ble_power_times, wur_power_times, power_per_packet)
-
-# Save power consumption data to CSV
-csv_filename = r'C:\Users\User\OneDrive\Documents\MATLAB\Examples\R2019b\bluetooth\BLEHeartRateExample/dutycycledwur.csv'
-save_power_to_csv(csv_filename, ble_power_times, wur_power_times, power_per_packet)
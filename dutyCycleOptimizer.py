@@ -0,0 +1,250 @@
+import math
+from multiprocessing import Pool
+
+from latencyStats import LatencyStats
+from powerModel import compute_energy
+from resultsStore import ResultsStore
+from scenarioEngine import load_scenario
+from wurSimulator import simulate
+
+# Duty-cycle optimizer. Finds the wake-up interval (dcw) or BLE sleep duration
+# (dcb) with the lowest average power whose response latency stays within a
+# budget. The response latency of a request is the wait for the next listening
+# opportunity plus the time from there to the first heart rate notification, so
+# it is bounded by a quantile of latencyStats' listen_gap plus the same quantile
+# of notification_latency.
+#
+# The search is derivative-free: a coarse scan over the bounds brackets the
+# best point, then golden-section search narrows the bracket. Candidates are
+# simulated with common random numbers (the same seeds for every value), and
+# the replications of all candidates in a step run in parallel. Every evaluated
+# point is cached, in memory and optionally in the results database, and the
+# Pareto front of energy against latency is built from all of them.
+
+GOLDEN_RATIO = (math.sqrt(5) - 1) / 2
+
+# Tunable parameter of each duty-cycled simulation model with its default search bounds.
+# dcw needs an interval of at least 2 s: with 1 s the WuR never wakes on schedule.
+TUNABLE_PARAMETERS = {'dcw': ('wake_up_interval', (2, 120)),
+                      'dcb': ('sleep_duration', (1, 120))}
+
+OPTIMIZER_TIME_LIMIT = 6 * 60 * 60  # Simulated seconds per replication
+REPLICATIONS = 4                    # Seeded runs averaged per candidate
+SCAN_POINTS = 8                     # Evenly spaced candidates of the initial scan
+LATENCY_QUANTILE = 0.99
+RESOLUTION = 1                      # Candidate values are multiples of this (seconds)
+
+
+def _evaluate_job(arguments):
+    scenario, parameter, value, time_limit, seed = arguments
+    run = simulate(scenario, time_limit=time_limit, seed=seed, fast_forward=True, **{parameter: value})
+    totals = compute_energy(run['events'], scenario,
+                            sleep_duration=value if parameter == 'sleep_duration' else None)
+    stats = LatencyStats().feed_events(run['events']).finish_run()
+    return totals, run['duration'], stats.to_dict()
+
+
+def response_latency(stats, quantile=LATENCY_QUANTILE):
+    """
+    Bound on the response latency quantile: listen gap plus notification
+    latency. Infinite when a run never listened or never notified.
+    """
+    latency = (stats.sketches['listen_gap'].quantile(quantile) +
+               stats.sketches['notification_latency'].quantile(quantile))
+    return math.inf if math.isnan(latency) else latency
+
+
+def _point(scenario, parameter, value, results, quantile):
+    totals = {key: sum(result[0][key] for result in results) for key in results[0][0]}
+    duration = sum(result[1] for result in results)
+    stats = LatencyStats()
+    for result in results:
+        stats.merge(LatencyStats.from_dict(result[2]))
+    return {'scenario': scenario,
+            'parameter': parameter,
+            'value': value,
+            'energy_rate': totals['total'] / duration if duration else math.inf,
+            'energy': totals['total'] / len(results),
+            'latency': response_latency(stats, quantile),
+            'listen_gap': stats.sketches['listen_gap'].quantile(quantile),
+            'notification_latency': stats.sketches['notification_latency'].quantile(quantile),
+            'totals': totals,
+            'duration': duration}
+
+
+def pareto_front(points):
+    """
+    Points not dominated in (energy_rate, latency), by increasing latency.
+    """
+    front = []
+    for point in sorted(points, key=lambda p: (p['latency'], p['energy_rate'])):
+        if not front or point['energy_rate'] < front[-1]['energy_rate']:
+            front.append(point)
+    return front
+
+
+class DutyCycleOptimizer:
+    """
+    Golden-section search of one scenario's tunable parameter. Evaluated points
+    are kept in self.points (value -> point) and reused across optimize calls;
+    with a db_path they are also recorded in, and reloaded from, the results
+    database under source 'optimizer'.
+    """
+
+    def __init__(self, scenario, parameter=None, bounds=None, time_limit=OPTIMIZER_TIME_LIMIT,
+                 replications=REPLICATIONS, seed=0, quantile=LATENCY_QUANTILE, resolution=RESOLUTION,
+                 processes=None, db_path=None):
+        if parameter is None or bounds is None:
+            model = load_scenario(scenario).model
+            if model not in TUNABLE_PARAMETERS:
+                raise ValueError(f"No tunable parameter known for scenario {scenario!r}, expected a simulation "
+                                 f"model in {list(TUNABLE_PARAMETERS)} or an explicit parameter and bounds")
+            default_parameter, default_bounds = TUNABLE_PARAMETERS[model]
+            parameter = parameter or default_parameter
+            bounds = bounds or default_bounds
+        if parameter not in ('wake_up_interval', 'sleep_duration'):
+            raise ValueError(f"Cannot optimize {parameter!r}, expected 'wake_up_interval' or 'sleep_duration'")
+        if bounds[0] > bounds[1]:
+            raise ValueError(f"Empty search bounds {bounds}")
+        if resolution <= 0:
+            raise ValueError("resolution must be positive")
+
+        self.scenario = scenario
+        self.parameter = parameter
+        self.resolution = resolution if parameter == 'sleep_duration' else max(1, round(resolution))
+        self.bounds = (self.snap(bounds[0]), self.snap(bounds[1]))
+        self.time_limit = time_limit
+        self.replications = replications
+        self.seed = seed
+        self.quantile = quantile
+        self.processes = processes
+        self.db_path = db_path
+        self.points = {}
+        if db_path is not None:
+            self._load_points()
+
+    def snap(self, value):
+        """
+        Round a value to the candidate grid; wake-up intervals are whole seconds.
+        """
+        value = round(value / self.resolution) * self.resolution
+        return int(value) if self.parameter == 'wake_up_interval' or float(value).is_integer() else value
+
+    def _settings(self):
+        return {'time_limit': self.time_limit, 'seed': self.seed, 'replications': self.replications,
+                'quantile': self.quantile}
+
+    def _load_points(self):
+        settings = self._settings()
+        with ResultsStore(self.db_path) as store:
+            for run in store.find_runs(self.scenario, order_by='id', time_limit=self.time_limit, seed=self.seed):
+                parameters = run['parameters']
+                if run['source'] == 'optimizer' and self.parameter in parameters and \
+                        all(parameters.get(key) == value for key, value in settings.items()):
+                    self.points[parameters[self.parameter]] = run['summary']
+
+    def _record_points(self, points):
+        settings = self._settings()
+        with ResultsStore(self.db_path) as store:
+            store.record_runs([(self.scenario, {self.parameter: point['value'], **settings}, point['totals'],
+                                (), point, 'optimizer') for point in points])
+
+    def evaluate(self, values, pool):
+        """
+        Evaluate the values not in the cache, all replications in parallel,
+        and return the points of every value.
+        """
+        pending = [value for value in dict.fromkeys(values) if value not in self.points]
+        jobs = [(self.scenario, self.parameter, value, self.time_limit, self.seed + i)
+                for value in pending for i in range(self.replications)]
+        results = pool.map(_evaluate_job, jobs) if jobs else []
+        new_points = []
+        for i, value in enumerate(pending):
+            point = _point(self.scenario, self.parameter, value,
+                           results[i * self.replications:(i + 1) * self.replications], self.quantile)
+            self.points[value] = point
+            new_points.append(point)
+        if new_points and self.db_path is not None:
+            self._record_points(new_points)
+        return [self.points[value] for value in values]
+
+    def optimize(self, latency_budget, scan_points=SCAN_POINTS):
+        """
+        Lowest-energy value whose response latency is within latency_budget
+        (seconds). Points over budget rank by how far over they are, so the
+        search moves towards feasibility first.
+
+        Returns the best point (None if no evaluated point met the budget),
+        every evaluated point and their Pareto front.
+        """
+        def rank(value):
+            point = self.points[value]
+            return max(0.0, point['latency'] - latency_budget), point['energy_rate']
+
+        low, high = self.bounds
+        evaluated = len(self.points)
+        with Pool(self.processes) as pool:
+            # Coarse scan to bracket the best region, the search may not be unimodal
+            count = max(scan_points, 2)
+            scan = sorted(set(self.snap(low + (high - low) * i / (count - 1)) for i in range(count)))
+            self.evaluate(scan, pool)
+            best = min(range(len(scan)), key=lambda i: rank(scan[i]))
+            low, high = scan[max(best - 1, 0)], scan[min(best + 1, len(scan) - 1)]
+
+            # Golden-section search within the bracket
+            while True:
+                a = self.snap(high - GOLDEN_RATIO * (high - low))
+                b = self.snap(low + GOLDEN_RATIO * (high - low))
+                if not low < a < b < high:
+                    break
+                self.evaluate([a, b], pool)
+                if rank(a) <= rank(b):
+                    high = b
+                else:
+                    low = a
+            # The bracket cannot be split further; settle the few values left in it
+            self.evaluate([self.snap(low + i * self.resolution)
+                           for i in range(round((high - low) / self.resolution) + 1)], pool)
+
+        points = sorted(self.points.values(), key=lambda p: p['value'])
+        feasible = [point for point in points if point['latency'] <= latency_budget]
+        return {'scenario': self.scenario,
+                'parameter': self.parameter,
+                'latency_budget': latency_budget,
+                'best': min(feasible, key=lambda p: p['energy_rate']) if feasible else None,
+                'evaluations': points,
+                'new_evaluations': len(self.points) - evaluated,
+                'pareto_front': pareto_front(points)}
+
+
+def optimize_duty_cycles(latency_budget, scenarios=tuple(TUNABLE_PARAMETERS), **optimizer_kwargs):
+    """
+    Optimize every scenario's tunable parameter under the same latency budget.
+    Returns the per-scenario results, the best point overall and the combined
+    Pareto front.
+    """
+    results = {scenario: DutyCycleOptimizer(scenario, **optimizer_kwargs).optimize(latency_budget)
+               for scenario in scenarios}
+    best = [result['best'] for result in results.values() if result['best'] is not None]
+    return {'latency_budget': latency_budget,
+            'scenarios': results,
+            'best': min(best, key=lambda p: p['energy_rate']) if best else None,
+            'pareto_front': pareto_front([point for result in results.values()
+                                          for point in result['evaluations']])}
+
+
+def print_optimization(result):
+    """
+    Print the best point and the Pareto front of an optimization.
+    """
+    print(f"Latency budget: {result['latency_budget']:g}s")
+    best = result['best']
+    if best is None:
+        print("No evaluated point meets the latency budget")
+    else:
+        print(f"Best: {best['scenario']} {best['parameter']} = {best['value']:g}s, "
+              f"{best['energy_rate']:.6e} per simulated second, latency {best['latency']:.2f}s")
+    print("Pareto front (latency, energy per simulated second):")
+    for point in result['pareto_front']:
+        print(f"  {point['scenario']} {point['parameter']} = {point['value']:g}s: "
+              f"{point['latency']:.2f}s, {point['energy_rate']:.6e}")
@@ -12,6 +12,21 @@ isCacheInitialized = false; % Keeps track of whether cache is initialized
 % Emergency heart rate notification threshold
 heartRateThreshold = 140;
 
+% Optional recorded heart-rate trace (raw little-endian uint16 bpm samples).
+% The trace is memory-mapped, so weeks of samples are paged in on demand and
+% batch runs over a patient cohort share the same file through the OS cache.
+% Set heartRateTraceFile before running the script to replay a recording.
+if ~exist('heartRateTraceFile', 'var')
+    heartRateTraceFile = ''; % Empty: draw random heart rates
+end
+if ~exist('heartRateTraceSamplePeriod', 'var')
+    heartRateTraceSamplePeriod = 1; % Seconds between trace samples
+end
+if ~isempty(heartRateTraceFile)
+    heartRateTrace = memmapfile(heartRateTraceFile, 'Format', 'uint16');
+    heartRateTraceLength = numel(heartRateTrace.Data);
+end
+
 % Seed the random number generator based on the current time
 rng('shuffle');
 
@@ -60,7 +75,13 @@ while true
 
         
         % Randomly simulate a heart rate event
-        heartRateMeasurementValue = randi([60 180]); % Simulate heart rate
+        if isempty(heartRateTraceFile)
+            heartRateMeasurementValue = randi([60 180]); % Simulate heart rate
+        else
+            % Recorded heart rate at the current simulation time (wraps around the trace)
+            traceIndex = mod(floor(currentTime / heartRateTraceSamplePeriod), heartRateTraceLength) + 1;
+            heartRateMeasurementValue = double(heartRateTrace.Data(traceIndex));
+        end
 
         if heartRateMeasurementValue < heartRateThreshold
             disp (['Normal Heart rate of ' num2str(heartRateMeasurementValue) ' bpm detected. Sending notification...']);
@@ -402,7 +423,13 @@ while true
             fprintf(logFile, 'Time %ds: Using cached discovery data (services, characteristics, descriptors).\n', currentTime);
         end               
         % Randomly simulate a high heart rate event to trigger an emergency transmission
-        heartRateMeasurementValue = randi([60 180]); % Simulate heart rate
+        if isempty(heartRateTraceFile)
+            heartRateMeasurementValue = randi([60 180]); % Simulate heart rate
+        else
+            % Recorded heart rate at the current simulation time (wraps around the trace)
+            traceIndex = mod(floor(currentTime / heartRateTraceSamplePeriod), heartRateTraceLength) + 1;
+            heartRateMeasurementValue = double(heartRateTrace.Data(traceIndex));
+        end
 
         gattServer = helperBLEGATTServer;
         gattClient = helperBLEGATTClient;
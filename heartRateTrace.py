@@ -0,0 +1,152 @@
+import os
+import numpy as np
+import pandas as pd
+from multiprocessing import Pool
+
+# Emergency heart rate notification threshold (matches the MATLAB simulations)
+HEART_RATE_THRESHOLD = 140
+
+# Recorded traces are raw little-endian uint16 bpm samples, the same layout the
+# MATLAB scripts read through memmapfile(heartRateTraceFile, 'Format', 'uint16')
+TRACE_DTYPE = np.dtype('<u2')
+SAMPLE_PERIOD = 1.0  # Seconds between trace samples
+
+CHUNK_SAMPLES = 1 << 20  # Samples processed per streaming step
+
+# Notification classes, mirroring the `<` and `>` checks in the simulations
+NOTIFY_NONE = 0       # Heart rate exactly at the threshold: no notification sent
+NOTIFY_NORMAL = 1
+NOTIFY_EMERGENCY = 2
+
+
+class HeartRateTrace:
+    """
+    Memory-mapped heart-rate recording. Samples are paged in on demand, so a
+    trace covering weeks of samples is never loaded into memory as a whole, and
+    processes opening the same file share its pages through the OS cache.
+    """
+
+    def __init__(self, trace_path, sample_period=SAMPLE_PERIOD):
+        self.trace_path = trace_path
+        self.sample_period = sample_period
+        self.samples = np.memmap(trace_path, dtype=TRACE_DTYPE, mode='r')
+        if len(self.samples) == 0:
+            raise ValueError(f"Heart-rate trace {trace_path} is empty")
+
+    def __len__(self):
+        return len(self.samples)
+
+    def index_at(self, time_sec):
+        """
+        Sample index for a simulation time, wrapping around the end of the trace.
+        """
+        return np.floor_divide(np.asarray(time_sec, dtype=float), self.sample_period).astype(np.int64) % len(self.samples)
+
+    def value_at(self, time_sec):
+        """
+        Recorded heart rate (bpm) at one simulation time.
+        """
+        return int(self.samples[int(self.index_at(time_sec))])
+
+    def values_at(self, times):
+        """
+        Recorded heart rates (bpm) for an array of simulation times.
+        """
+        return np.asarray(self.samples[self.index_at(times)], dtype=np.int64)
+
+    def iter_chunks(self, chunk_samples=CHUNK_SAMPLES):
+        """
+        Yield (start_index, samples) views over the trace without copying it.
+        """
+        for start in range(0, len(self.samples), chunk_samples):
+            yield start, self.samples[start:start + chunk_samples]
+
+
+def classify_heart_rates(values, threshold=HEART_RATE_THRESHOLD):
+    """
+    Classify heart rates into NOTIFY_NORMAL, NOTIFY_EMERGENCY or NOTIFY_NONE.
+    """
+    values = np.asarray(values)
+    classes = np.full(values.shape, NOTIFY_NONE, dtype=np.int8)
+    classes[values < threshold] = NOTIFY_NORMAL
+    classes[values > threshold] = NOTIFY_EMERGENCY
+    return classes
+
+
+def notification_counts(classes):
+    """
+    Count the normal and emergency notifications in an array of classes.
+    """
+    counts = np.bincount(np.asarray(classes, dtype=np.int64), minlength=3)
+    return {'normal': int(counts[NOTIFY_NORMAL]),
+            'emergency': int(counts[NOTIFY_EMERGENCY]),
+            'none': int(counts[NOTIFY_NONE])}
+
+
+def classify_notifications(trace, notification_times, threshold=HEART_RATE_THRESHOLD,
+                           chunk_samples=CHUNK_SAMPLES):
+    """
+    Decide normal versus emergency for every notification time, streaming the
+    times in chunks so only the trace pages that are actually hit are read.
+    """
+    notification_times = np.asarray(notification_times, dtype=float)
+    classes = np.empty(len(notification_times), dtype=np.int8)
+    for start in range(0, len(notification_times), chunk_samples):
+        stop = start + chunk_samples
+        classes[start:stop] = classify_heart_rates(trace.values_at(notification_times[start:stop]), threshold)
+    return classes
+
+
+def summarize_trace(trace_path, threshold=HEART_RATE_THRESHOLD, sample_period=SAMPLE_PERIOD,
+                    notification_interval=None):
+    """
+    Stream through a whole trace and count normal and emergency notifications.
+
+    With a notification_interval (seconds) only the samples at which the
+    implant would notify are considered; otherwise every sample is counted.
+    """
+    trace = HeartRateTrace(trace_path, sample_period)
+    counts = np.zeros(3, dtype=np.int64)
+    stride = 1
+    if notification_interval is not None:
+        stride = max(1, int(round(notification_interval / sample_period)))
+
+    for start, chunk in trace.iter_chunks():
+        # Keep the notification grid aligned across chunk boundaries
+        offset = (-start) % stride
+        counts += np.bincount(classify_heart_rates(chunk[offset::stride], threshold), minlength=3)
+
+    return {'trace': os.path.basename(trace_path),
+            'samples': len(trace),
+            'duration_s': len(trace) * sample_period,
+            'normal': int(counts[NOTIFY_NORMAL]),
+            'emergency': int(counts[NOTIFY_EMERGENCY]),
+            'none': int(counts[NOTIFY_NONE])}
+
+
+def _summarize_trace_job(args):
+    return summarize_trace(*args)
+
+
+def summarize_cohort(trace_paths, threshold=HEART_RATE_THRESHOLD, sample_period=SAMPLE_PERIOD,
+                     notification_interval=None, processes=None):
+    """
+    Summarize a patient cohort in parallel. Workers receive only trace paths and
+    map the files themselves, so no sample data is pickled between processes.
+    """
+    jobs = [(path, threshold, sample_period, notification_interval) for path in trace_paths]
+    with Pool(processes) as pool:
+        return pool.map(_summarize_trace_job, jobs)
+
+
+def convert_csv_to_trace(csv_path, trace_path, column='Heart Rate (bpm)', chunksize=CHUNK_SAMPLES):
+    """
+    Convert a recorded CSV heart-rate series into the raw uint16 trace format,
+    streaming the CSV in chunks.
+    """
+    with open(trace_path, 'wb') as trace_file:
+        for chunk in pd.read_csv(csv_path, usecols=[column], chunksize=chunksize):
+            values = np.clip(np.rint(chunk[column].dropna().to_numpy(dtype=float)), 0, np.iinfo(TRACE_DTYPE).max)
+            trace_file.write(values.astype(TRACE_DTYPE).tobytes())
+
+    print(f"Heart-rate trace saved to {trace_path}")
@@ -0,0 +1,348 @@
+import os
+import sys
+import json
+import stat
+import signal
+import argparse
+import threading
+import multiprocessing
+import http.client
+import socket
+import socketserver
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+try:
+    import pyshark
+except ImportError:
+    pyshark = None
+
+from latencyStats import LatencyStats
+from powerModel import compute_energy
+from replayKernel import encode_log, event_powers, log_times, replay, scenario_energy
+from scenarioEngine import list_scenarios, load_scenario
+from wurSimulator import simulate
+
+# Warm local job server. A long-running process answers simulation and power
+# jobs over HTTP on localhost or on a Unix socket, so dashboard queries do not
+# pay interpreter start-up, imports and cold caches every time. Jobs run on a
+# bounded pool of worker processes that compile every scenario when they start
+# and keep encoded logs and pcap packet lengths cached, keyed by file size and
+# modification time. Identical jobs submitted while one is still running are
+# coalesced: they all wait on the same computation.
+#
+#   POST /simulate  {"scenario": "dcw", "time_limit": 3600, "seed": 1, "wake_up_interval": 10}
+#   POST /power     {"scenario": "aow", "log_file": "aowstate_log.txt", "pcap_file": "HeartRateImplant(1).pcap"}
+#   GET  /status
+
+DEFAULT_HOST = '127.0.0.1'  # Local only: jobs read any file path they are given
+DEFAULT_PORT = 8765
+MAX_PENDING = 64            # Distinct jobs queued or running before new ones are refused
+MAX_CACHED_INPUTS = 32      # Encoded logs and pcaps kept per worker
+MAX_REQUEST_BYTES = 1 << 20
+
+SIMULATION_PARAMETERS = ('scenario', 'time_limit', 'seed', 'reconnection_probability', 'wake_up_interval',
+                         'sleep_duration', 'fast_forward', 'N_channels', 't_comm')
+POWER_PARAMETERS = ('scenario', 'log_file', 'pcap_file', 'packet_lengths', 'N_channels', 't_comm', 'sleep_duration')
+
+_input_cache = {}
+
+
+class ServerBusy(RuntimeError):
+    """
+    Raised when MAX_PENDING distinct jobs are already queued or running.
+    """
+
+
+def _warm_up():
+    # Runs once in every worker process: compile the scenarios and their classifiers
+    for name in list_scenarios():
+        load_scenario(name)
+
+
+def _cached_input(path, load):
+    status = os.stat(path)
+    key = (load.__name__, os.path.abspath(path), status.st_size, status.st_mtime_ns)
+    if key not in _input_cache:
+        if len(_input_cache) >= MAX_CACHED_INPUTS:
+            _input_cache.pop(next(iter(_input_cache)))
+        _input_cache[key] = load(path)
+    return _input_cache[key]
+
+
+def _read_pcap(pcap_file_path):
+    # Packet numbers and lengths, as parse_pcap_file in the power-compute scripts
+    if pyshark is None:
+        raise ValueError("pyshark is required to read pcap files; pass packet_lengths instead")
+    packet_lengths = {}
+    capture = pyshark.FileCapture(pcap_file_path)
+    try:
+        for packet in capture:
+            try:
+                packet_lengths[int(packet.number)] = int(packet.length)
+            except AttributeError:
+                continue
+    finally:
+        capture.close()
+    return packet_lengths
+
+
+def _check_parameters(kind, params, allowed):
+    if not isinstance(params, dict):
+        raise ValueError(f"{kind} job parameters must be a JSON object")
+    unknown = set(params) - set(allowed)
+    if unknown:
+        raise ValueError(f"Unknown {kind} parameters {sorted(unknown)}, expected some of {list(allowed)}")
+    if 'scenario' not in params:
+        raise ValueError(f"{kind} job needs a scenario")
+
+
+def run_simulation_job(params):
+    """
+    Simulate one run and return its energy, latency statistics and counters
+    (not the events themselves). Fast-forward is on unless disabled.
+    """
+    _check_parameters('simulate', params, SIMULATION_PARAMETERS)
+    options = {key: params[key] for key in ('time_limit', 'seed', 'reconnection_probability', 'wake_up_interval',
+                                            'sleep_duration') if params.get(key) is not None}
+    run = simulate(params['scenario'], fast_forward=params.get('fast_forward', True), **options)
+    energy = compute_energy(run['events'], params['scenario'], params.get('N_channels'), params.get('t_comm'),
+                            params.get('sleep_duration'))
+    return {'scenario': params['scenario'],
+            'duration': run['duration'],
+            'wake_ups': run['wake_ups'],
+            'reconnections': run['reconnections'],
+            'energy': energy,
+            'latency': LatencyStats().feed_events(run['events']).finish_run().summary()}
+
+
+def run_power_job(params):
+    """
+    Replay a state log and return the power-compute totals, with pcap packet
+    lengths from pcap_file or packet_lengths ({packet number: length}).
+    """
+    _check_parameters('power', params, POWER_PARAMETERS)
+    if 'log_file' not in params:
+        raise ValueError("power job needs a log_file")
+    scenario = params['scenario']
+    ticks, codes, encoder = _cached_input(params['log_file'], encode_log)
+    if params.get('pcap_file') is not None:
+        packet_lengths = _cached_input(params['pcap_file'], _read_pcap)
+    elif params.get('packet_lengths') is not None:
+        packet_lengths = {int(number): int(length) for number, length in params['packet_lengths'].items()}
+    else:
+        packet_lengths = None
+
+    result = replay(ticks, codes, encoder, scenario)
+    _, total_power_BLE = event_powers(codes, encoder, scenario, packet_lengths, params.get('N_channels'),
+                                      params.get('t_comm'))
+    WuR_times, BLE_times, ble_sleep_periods = log_times(result)
+    return {'scenario': scenario,
+            'events': len(codes),
+            'energy': scenario_energy(scenario, result, total_power_BLE, params.get('sleep_duration')),
+            'WuR_times': WuR_times,
+            'BLE_times': BLE_times,
+            'ble_sleep_periods': len(ble_sleep_periods),
+            'fixed_sleep_phases': result['fixed_sleep_phases']}
+
+
+JOBS = {'simulate': run_simulation_job, 'power': run_power_job}
+
+
+def _run_job(kind, params):
+    return JOBS[kind](params)
+
+
+class JobServer:
+    """
+    Bounded worker pool with request coalescing. Jobs are keyed by kind and
+    canonical JSON parameters; a job identical to one in flight returns that
+    job's future instead of being computed again.
+    """
+
+    def __init__(self, workers=None, max_pending=MAX_PENDING):
+        # Spawned workers do not inherit the server's listening socket
+        self.executor = ProcessPoolExecutor(workers, multiprocessing.get_context('spawn'), initializer=_warm_up)
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.max_pending = max_pending
+        self.counts = {'submitted': 0, 'coalesced': 0, 'completed': 0, 'failed': 0, 'rejected': 0}
+
+    def submit(self, kind, params):
+        if kind not in JOBS:
+            raise ValueError(f"Unknown job {kind!r}, expected one of {list(JOBS)}")
+        key = (kind, json.dumps(params, sort_keys=True))
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is not None:
+                self.counts['coalesced'] += 1
+                return future
+            if len(self.in_flight) >= self.max_pending:
+                self.counts['rejected'] += 1
+                raise ServerBusy(f"{self.max_pending} jobs already pending")
+            self.counts['submitted'] += 1
+            future = self.executor.submit(_run_job, kind, params)
+            self.in_flight[key] = future
+        future.add_done_callback(lambda done: self._finished(key, done))
+        return future
+
+    def _finished(self, key, future):
+        with self.lock:
+            self.in_flight.pop(key, None)
+            self.counts['failed' if future.cancelled() or future.exception() is not None else 'completed'] += 1
+
+    def run(self, kind, params, timeout=None):
+        return self.submit(kind, params).result(timeout)
+
+    def status(self):
+        with self.lock:
+            return {'pending': len(self.in_flight), 'max_pending': self.max_pending, **self.counts}
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class _JobRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'WuRJobServer/1.0'
+
+    def address_string(self):
+        # Unix socket clients have no (host, port) address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def _reply(self, code, body):
+        data = json.dumps(body, default=_json_default).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/status':
+            self._reply(200, self.server.jobs.status())
+        else:
+            self._reply(404, {'error': f"Unknown path {self.path!r}"})
+
+    def do_POST(self):
+        kind = self.path.strip('/')
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length > MAX_REQUEST_BYTES:
+                raise ValueError("Request body too large")
+            params = json.loads(self.rfile.read(length) or b'{}')
+            result = self.server.jobs.run(kind, params)
+        except ServerBusy as error:
+            self._reply(503, {'error': str(error)})
+        except (ValueError, KeyError, TypeError, OSError) as error:
+            self._reply(400, {'error': str(error)})
+        except Exception as error:
+            self._reply(500, {'error': f"{type(error).__name__}: {error}"})
+        else:
+            self._reply(200, result)
+
+
+class _HTTPJobServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class _UnixJobServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None, workers=None, max_pending=MAX_PENDING,
+                quiet=False):
+    """
+    Create the server, on a Unix socket if socket_path is given, otherwise on
+    host:port. A stale socket file left by an earlier server is replaced.
+    """
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                raise ValueError(f"{socket_path} exists and is not a socket")
+            os.remove(socket_path)
+        server = _UnixJobServer(socket_path, _JobRequestHandler)
+    else:
+        server = _HTTPJobServer((host, port), _JobRequestHandler)
+    server.jobs = JobServer(workers, max_pending)
+    server.quiet = quiet
+    return server
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None, workers=None, max_pending=MAX_PENDING,
+          quiet=False):
+    """
+    Serve jobs until interrupted, then stop the workers and remove the socket.
+    """
+    server = make_server(host, port, socket_path, workers, max_pending, quiet)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.jobs.close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def submit_job(kind, params=None, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None, timeout=None):
+    """
+    Send a job to a running server and return its result; kind 'status'
+    returns the server counters. Raises RuntimeError with the server's error.
+    """
+    if socket_path is not None:
+        connection = _UnixHTTPConnection(socket_path, timeout)
+    else:
+        connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        if kind == 'status':
+            connection.request('GET', '/status')
+        else:
+            connection.request('POST', f'/{kind}', json.dumps(params or {}), {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        body = json.loads(response.read())
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise RuntimeError(f"Job {kind!r} failed ({response.status}): {body.get('error')}")
+    return body
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Warm local server for simulation and power-compute jobs')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--socket', dest='socket_path', help='Serve on this Unix socket instead of host:port')
+    parser.add_argument('--workers', type=int, help='Worker processes (default: CPU count)')
+    parser.add_argument('--max-pending', type=int, default=MAX_PENDING)
+    parser.add_argument('--quiet', action='store_true', help='Do not log requests')
+    arguments = parser.parse_args()
+    # Stop like on Ctrl+C, so the workers shut down and the socket is removed
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    serve(arguments.host, arguments.port, arguments.socket_path, arguments.workers, arguments.max_pending,
+          arguments.quiet)
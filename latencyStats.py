@@ -0,0 +1,261 @@
+import math
+from multiprocessing import Pool
+
+from wurSimulator import IdleRun, iter_log
+
+# Wake-up latency and on-time statistics, computed while streaming events.
+# Distributions are kept in mergeable quantile sketches, so p50/p99/p99.9 of
+# many runs and workers can be combined in constant memory.
+
+RELATIVE_ACCURACY = 0.01  # Quantiles are within 1% of the true value
+MAX_BUCKETS = 2048        # Upper bound on sketch size; lowest buckets collapse beyond it
+MIN_VALUE = 1e-9          # Values at or below this (e.g. 0 s) go to the zero bucket
+
+QUANTILES = (0.5, 0.99, 0.999)
+
+# Log markers of the wake-up cycle
+WAKE_UP_STARTS = ('Wake-up signal detected',
+                  'BLE device is waking up to send heart rate measurement notification')
+BLE_AWAKE = 'BLE device is now awake and communicating'
+NOTIFICATION = 'heart rate measurement notification'
+BLE_ASLEEP = 'Putting BLE device back to sleep'
+
+# Moments a wake-up request can first be heard: a WuR check, or a duty-cycled BLE wake-up
+LISTEN_STARTS = ('Wake-up radio is checking for a signal',
+                 'Wake-up radio is awake and checking for a signal',
+                 'BLE device is waking up')
+
+METRICS = ('wake_up_latency', 'notification_latency', 'on_time', 'listen_gap')
+
+
+class QuantileSketch:
+    """
+    Relative-error quantile sketch with logarithmic buckets (DDSketch). Two
+    sketches with the same accuracy merge by adding bucket counts, and the
+    bucket count is capped so memory stays constant however many values are added.
+    """
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY, max_buckets=MAX_BUCKETS):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value, count=1):
+        if value <= MIN_VALUE:
+            self.zero_count += count
+        else:
+            key = math.ceil(math.log(value) / self.log_gamma)
+            self.buckets[key] = self.buckets.get(key, 0) + count
+            if len(self.buckets) > self.max_buckets:
+                self._collapse()
+        self.count += count
+        self.sum += value * count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def _collapse(self):
+        # Fold the lowest buckets together; only the smallest quantiles lose accuracy
+        keys = sorted(self.buckets)
+        excess = len(keys) - self.max_buckets
+        merged = sum(self.buckets.pop(key) for key in keys[:excess + 1])
+        self.buckets[keys[excess]] = merged
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different accuracies")
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        if self.count == 0:
+            return math.nan
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+        seen = self.zero_count
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                value = 2 * self.gamma ** key / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else math.nan
+
+    def to_dict(self):
+        return {'relative_accuracy': self.relative_accuracy, 'max_buckets': self.max_buckets,
+                'buckets': self.buckets, 'zero_count': self.zero_count, 'count': self.count,
+                'sum': self.sum, 'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['relative_accuracy'], data['max_buckets'])
+        sketch.buckets = {int(key): count for key, count in data['buckets'].items()}
+        for name in ('zero_count', 'count', 'sum', 'min', 'max'):
+            setattr(sketch, name, data[name])
+        return sketch
+
+
+class LatencyStats:
+    """
+    Streaming latency and on-time statistics over (time, description) events:
+
+    wake_up_latency: wake-up signal detected -> BLE awake and communicating
+    notification_latency: wake-up start -> first heart rate notification
+    on_time: BLE awake (or waking up) -> BLE back to sleep
+    listen_gap: one listening opportunity -> the next; a request arriving
+        in between waits up to this long before it can be heard
+    """
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY):
+        self.sketches = {metric: QuantileSketch(relative_accuracy) for metric in METRICS}
+        self.observed_time = 0
+        self.first_time = None
+        self.last_time = None
+        self.wake_up_start = None
+        self.awake_start = None
+        self.notified = False
+        self.listen_start = None
+
+    def feed(self, time_sec, description):
+        if self.first_time is None:
+            self.first_time = time_sec
+        self.last_time = time_sec
+
+        if any(marker in description for marker in LISTEN_STARTS):
+            if self.listen_start is not None:
+                self.sketches['listen_gap'].add(time_sec - self.listen_start)
+            self.listen_start = time_sec
+
+        if any(marker in description for marker in WAKE_UP_STARTS):
+            self.wake_up_start = time_sec
+            self.notified = False
+            # A re-wake without a sleep line in between continues the same on-interval
+            if 'BLE device is waking up' in description and self.awake_start is None:
+                self.awake_start = time_sec
+        elif BLE_AWAKE in description:
+            if self.wake_up_start is not None:
+                self.sketches['wake_up_latency'].add(time_sec - self.wake_up_start)
+            if self.awake_start is None:
+                self.awake_start = time_sec
+        elif NOTIFICATION in description:
+            if self.wake_up_start is not None and not self.notified:
+                self.sketches['notification_latency'].add(time_sec - self.wake_up_start)
+                self.notified = True
+        elif BLE_ASLEEP in description:
+            if self.awake_start is not None:
+                self.sketches['on_time'].add(time_sec - self.awake_start)
+            self.awake_start = None
+            self.wake_up_start = None
+
+    def feed_events(self, events):
+        for item in events:
+            if isinstance(item, IdleRun):
+                # Idle stretches hold no wake-up markers, only listening opportunities that
+                # repeat every cycle: feed the first cycle, then count the later cycles' gaps
+                for offset, description in item.lines:
+                    self.feed(item.start_time + offset, description)
+                listens = [offset for offset, description in item.lines
+                           if any(marker in description for marker in LISTEN_STARTS)]
+                if listens and item.count > 1:
+                    gaps = [item.period - listens[-1] + listens[0]] + [b - a for a, b in zip(listens, listens[1:])]
+                    for gap in gaps:
+                        self.sketches['listen_gap'].add(gap, item.count - 1)
+                    self.listen_start = item.start_time + (item.count - 1) * item.period + listens[-1]
+                self.last_time = item.start_time + (item.count - 1) * item.period + item.lines[-1][0]
+                continue
+            self.feed(*item)
+        return self
+
+    def finish_run(self):
+        """
+        Close the current run so the next events start a fresh one.
+        """
+        if self.first_time is not None:
+            self.observed_time += self.last_time - self.first_time
+        self.first_time = self.last_time = None
+        self.wake_up_start = self.awake_start = self.listen_start = None
+        self.notified = False
+        return self
+
+    def merge(self, other):
+        for metric in METRICS:
+            self.sketches[metric].merge(other.sketches[metric])
+        self.observed_time += other.observed_time
+        return self
+
+    def summary(self, quantiles=QUANTILES):
+        """
+        Count, mean and quantiles of every metric, plus the BLE duty cycle
+        (fraction of observed time the BLE radio was on).
+        """
+        summary = {}
+        for metric, sketch in self.sketches.items():
+            summary[metric] = {'count': sketch.count, 'mean': sketch.mean,
+                               **{f'p{q * 100:g}': sketch.quantile(q) for q in quantiles}}
+        on_time = self.sketches['on_time'].sum
+        summary['ble_duty_cycle'] = on_time / self.observed_time if self.observed_time else math.nan
+        return summary
+
+    def to_dict(self):
+        return {'sketches': {metric: sketch.to_dict() for metric, sketch in self.sketches.items()},
+                'observed_time': self.observed_time}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.sketches.update({metric: QuantileSketch.from_dict(sketch)
+                               for metric, sketch in data['sketches'].items()})
+        stats.observed_time = data['observed_time']
+        return stats
+
+
+def latency_stats_for_log(log_file_path):
+    """
+    Stream one state log (compressed 'Times' lines included) into LatencyStats.
+    """
+    return LatencyStats().feed_events(iter_log(log_file_path)).finish_run()
+
+
+def _latency_stats_job(log_file_path):
+    return latency_stats_for_log(log_file_path).to_dict()
+
+
+def latency_stats_for_logs(log_file_paths, processes=None):
+    """
+    Compute statistics for many logs in worker processes and merge the sketches.
+    """
+    stats = LatencyStats()
+    with Pool(processes) as pool:
+        for data in pool.imap_unordered(_latency_stats_job, log_file_paths):
+            stats.merge(LatencyStats.from_dict(data))
+    return stats
+
+
+def print_latency_summary(summary):
+    """
+    Print latency and on-time quantiles in seconds.
+    """
+    for metric in METRICS:
+        values = summary[metric]
+        quantiles = ', '.join(f"{name}: {value:.2f}s" for name, value in values.items()
+                              if name.startswith('p'))
+        print(f"{metric} (n={values['count']}, mean {values['mean']:.2f}s): {quantiles}")
+    print(f"BLE duty cycle: {summary['ble_duty_cycle']:.2%}")
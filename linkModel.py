@@ -0,0 +1,214 @@
+import math
+import numpy as np
+
+from powerModel import compute_energy
+from replayKernel import EventEncoder, encode_events, event_powers
+from scenarioEngine import load_scenario
+from wurSimulator import IdleRun
+
+# In-body BLE link model. calculate_power charges every PDU once, as if it
+# always got through; through tissue the implant's link is lossy and
+# retransmissions become the main variable cost. The model derives a packet
+# error rate for each PDU from the link budget:
+#
+#     path loss = free-space loss at 1 m + 10 n log10(distance) + sum(thickness x attenuation)
+#     SNR = tx power + antenna gains - path loss - (thermal noise + noise figure + implementation loss)
+#     BER = 0.5 exp(-SNR / 2)                  (non-coherent GFSK, LE 1M PHY: Eb/N0 = SNR)
+#     PER = 1 - (1 - BER)^(8 x (PDU length + link-layer overhead))
+#
+# PDUs the implant transmits travel uplink (implant -> reader) and PDUs it
+# receives travel downlink. Each failed attempt is repeated until it succeeds,
+# so the retransmissions of a PDU are geometric, truncated at MAX_RETRANSMISSIONS.
+# They are drawn for every packet of every run in batched NumPy calls, one per
+# attempt, and each retransmission costs the PDU's transmit or receive energy again.
+
+SPEED_OF_LIGHT = 299792458.0
+BLE_FREQUENCY_HZ = 2.44e9
+BANDWIDTH_HZ = 1e6                 # LE 1M PHY, so Eb/N0 equals the SNR
+THERMAL_NOISE_DBM_HZ = -174.0
+LINK_LAYER_OVERHEAD = 10           # Preamble 1, access address 4, header 2 and CRC 3 bytes
+MAX_RETRANSMISSIONS = 10
+
+# Approximate attenuation of tissue layers at 2.4 GHz (dB per cm)
+TISSUE_ATTENUATION = {'skin': 2.6, 'fat': 0.8, 'muscle': 3.0, 'bone': 1.6}
+# Tissue between a subcutaneous implant and the body surface (cm per layer)
+DEFAULT_TISSUE = {'skin': 0.2, 'fat': 0.5, 'muscle': 1.0}
+
+LINK_DIRECTIONS = {'transmit': 'uplink', 'receive': 'downlink'}
+
+
+class LinkModel:
+    """
+    Link budget between the implant and the reader.
+
+    distance: reader distance from the body surface (m)
+    tissue: {tissue: thickness in cm} crossed by the signal, tissues from
+        TISSUE_ATTENUATION
+    shadowing_db: standard deviation of log-normal shadowing, drawn once per
+        run; 0 gives every run the same packet error rates
+    """
+
+    def __init__(self, distance=1.0, tissue=None, path_loss_exponent=2.0, implant_tx_power_dbm=0.0,
+                 reader_tx_power_dbm=0.0, implant_antenna_gain_dbi=-25.0, reader_antenna_gain_dbi=0.0,
+                 noise_figure_db=6.0, implementation_loss_db=6.0, shadowing_db=0.0,
+                 max_retransmissions=MAX_RETRANSMISSIONS):
+        tissue = DEFAULT_TISSUE if tissue is None else tissue
+        unknown = set(tissue) - set(TISSUE_ATTENUATION)
+        if unknown:
+            raise ValueError(f"Unknown tissue {sorted(unknown)}, expected one of {list(TISSUE_ATTENUATION)}")
+        if distance <= 0:
+            raise ValueError("distance must be positive")
+        self.distance = distance
+        self.tissue = dict(tissue)
+        self.path_loss_exponent = path_loss_exponent
+        self.tx_power_dbm = {'uplink': implant_tx_power_dbm, 'downlink': reader_tx_power_dbm}
+        self.antenna_gain_db = implant_antenna_gain_dbi + reader_antenna_gain_dbi
+        self.noise_dbm = (THERMAL_NOISE_DBM_HZ + 10 * math.log10(BANDWIDTH_HZ) + noise_figure_db +
+                          implementation_loss_db)
+        self.shadowing_db = shadowing_db
+        self.max_retransmissions = max_retransmissions
+
+    def tissue_loss_db(self):
+        return sum(thickness * TISSUE_ATTENUATION[name] for name, thickness in self.tissue.items())
+
+    def path_loss_db(self):
+        free_space_1m = 20 * math.log10(4 * math.pi * BLE_FREQUENCY_HZ / SPEED_OF_LIGHT)
+        return free_space_1m + 10 * self.path_loss_exponent * math.log10(self.distance) + self.tissue_loss_db()
+
+    def snr_db(self, direction, shadowing_db=0.0):
+        return self.tx_power_dbm[direction] + self.antenna_gain_db - self.path_loss_db() - shadowing_db - \
+            self.noise_dbm
+
+    def packet_error_rate(self, lengths, direction, shadowing_db=0.0):
+        """
+        PER of PDUs of the given lengths (bytes); lengths and shadowing_db broadcast.
+        """
+        snr = 10 ** (self.snr_db(direction, np.asarray(shadowing_db, dtype=np.float64)) / 10)
+        bit_error_rate = 0.5 * np.exp(-snr / 2)
+        bits = 8 * (np.asarray(lengths, dtype=np.float64) + LINK_LAYER_OVERHEAD)
+        return -np.expm1(bits * np.log1p(-bit_error_rate))
+
+    def expected_retransmissions(self, packet_error_rate):
+        """
+        Mean retransmissions of a PDU: sum of PER^k for k = 1..max_retransmissions.
+        """
+        per = np.asarray(packet_error_rate, dtype=np.float64)
+        k = self.max_retransmissions
+        return np.where(per < 1, per * (1 - per ** k) / np.where(per < 1, 1 - per, 1), k)
+
+    def summary(self):
+        per = {direction: float(self.packet_error_rate(37, direction)) for direction in ('uplink', 'downlink')}
+        return {'path_loss_db': self.path_loss_db(),
+                'tissue_loss_db': self.tissue_loss_db(),
+                'snr_db': {direction: self.snr_db(direction) for direction in ('uplink', 'downlink')},
+                'per_37_bytes': per}
+
+
+def _packet_codes(events, encoder):
+    # Codes of every event with its multiplicity (repetitions of an IdleRun cycle)
+    codes, counts, pending = [], [], []
+    for item in events:
+        if isinstance(item, IdleRun):
+            codes.extend(encoder.encode(description) for _, description in item.lines)
+            counts.extend([item.count] * len(item.lines))
+        else:
+            pending.append(item)
+    if pending:
+        codes.extend(encode_events(pending, encoder)[1].tolist())
+        counts.extend([1] * len(pending))
+    return codes, counts
+
+
+def retransmission_energy(runs, scenario, link=None, seed=None, rng=None, N_channels=None, t_comm=None):
+    """
+    Draw retransmissions for every packet of a batch of runs (lists of
+    events) and return per-run arrays: first-attempt 'transmit'/'receive'
+    packet energy, the retransmission energy and counts of each, and
+    'extra' (total retransmission energy, in the units of total_power_BLE).
+    """
+    compiled = load_scenario(scenario)
+    link = link or LinkModel()
+    if rng is None:
+        rng = np.random.default_rng(seed)
+    encoder = EventEncoder()
+
+    runs = list(runs)
+    packets = [_packet_codes(events, encoder) for events in runs]
+    codes = np.array([code for run_codes, _ in packets for code in run_codes], dtype=np.int64)
+    counts = np.array([count for _, run_counts in packets for count in run_counts], dtype=np.int64)
+    run = np.repeat(np.arange(len(runs)), [len(run_codes) for run_codes, _ in packets])
+
+    # Per-description tables: energy of one attempt, direction and PER
+    _, activity, length, uncharged = compiled.classify(encoder.descriptions)
+    attempt_energy, _ = event_powers(np.arange(len(encoder.descriptions)), encoder, compiled, None,
+                                     N_channels, t_comm)
+    directions = list(LINK_DIRECTIONS)
+    direction = np.full(len(encoder.descriptions), -1, dtype=np.int64)
+    for d, name in enumerate(directions):
+        index = compiled.activity_names.index(name) if name in compiled.activity_names else -1
+        direction[activity == index] = d
+    is_packet = (length > 0) & ~uncharged & (direction >= 0)
+
+    keep = is_packet[codes]
+    codes, counts, run = codes[keep], counts[keep], run[keep]
+    packet_direction = direction[codes]
+
+    # Shadowing is drawn per run, so a run's packets share its link quality
+    shadowing = rng.normal(0.0, link.shadowing_db, len(runs)) if link.shadowing_db else np.zeros(len(runs))
+    per = np.empty(len(codes))
+    for d, name in enumerate(directions):
+        selected = packet_direction == d
+        per[selected] = link.packet_error_rate(length[codes[selected]], LINK_DIRECTIONS[name], shadowing[run[selected]])
+
+    # Each PDU is retried until it gets through or reaches max_retransmissions:
+    # of the copies (an IdleRun packet repeated n times) that failed an attempt,
+    # a binomial share fails the next one and is retransmitted again
+    failing = counts
+    retransmissions = np.zeros(len(counts), dtype=np.int64)
+    for _ in range(link.max_retransmissions):
+        failing = rng.binomial(failing, per)
+        retransmissions += failing
+
+    result = {'runs': len(runs)}
+    for d, name in enumerate(directions):
+        selected = (packet_direction == d).astype(np.float64)
+        energy = attempt_energy[codes]
+        result[name] = np.bincount(run, weights=selected * energy * counts, minlength=len(runs))
+        result[f'{name}_retransmissions'] = np.bincount(run, weights=selected * retransmissions,
+                                                        minlength=len(runs))
+        result[f'{name}_retransmission_energy'] = np.bincount(run, weights=selected * energy * retransmissions,
+                                                              minlength=len(runs))
+        result[f'{name}_packets'] = np.bincount(run, weights=selected * counts, minlength=len(runs))
+    result['extra'] = result['transmit_retransmission_energy'] + result['receive_retransmission_energy']
+    return result
+
+
+def compute_link_energy(events, scenario, link=None, seed=None, rng=None, N_channels=None, t_comm=None,
+                        sleep_duration=None):
+    """
+    powerModel.compute_energy with retransmissions drawn by the link model;
+    'BLE' and 'total' include the retransmission energy, which is also
+    reported on its own as 'BLE_retransmission'.
+    """
+    energy = compute_energy(events, scenario, N_channels, t_comm, sleep_duration)
+    extra = float(retransmission_energy([events], scenario, link, seed, rng, N_channels, t_comm)['extra'][0])
+    energy['BLE'] += extra
+    energy['total'] += extra
+    energy['BLE_retransmission'] = extra
+    return energy
+
+
+def print_link_summary(link, result):
+    """
+    Print the link budget and the retransmission cost of a batch of runs.
+    """
+    summary = link.summary()
+    print(f"Path loss: {summary['path_loss_db']:.1f} dB ({summary['tissue_loss_db']:.1f} dB tissue), "
+          f"SNR uplink {summary['snr_db']['uplink']:.1f} dB, downlink {summary['snr_db']['downlink']:.1f} dB")
+    for name in LINK_DIRECTIONS:
+        packets = result[f'{name}_packets'].sum()
+        retransmissions = result[f'{name}_retransmissions'].sum()
+        share = result[f'{name}_retransmission_energy'].sum() / result[name].sum() if result[name].sum() else 0.0
+        print(f"{name}: {packets:.0f} packets, {retransmissions:.0f} retransmissions "
+              f"({retransmissions / packets if packets else 0:.3f} per packet), +{share:.1%} energy")
+    print(f"Retransmission energy per run: {result['extra'].mean():.6e}")
@@ -0,0 +1,183 @@
+import os
+import mmap
+from itertools import product
+from multiprocessing import Pool
+
+import numpy as np
+
+from replayKernel import (N_CLOCK, encode_events, replay_codes, finish_replay, new_state, synchronizing_index)
+from scenarioEngine import load_scenario
+from wurSimulator import expand_events, iter_log_lines
+
+# Parallel replay of very large state logs. The log is memory-mapped and split
+# at line boundaries into chunks that worker processes replay independently.
+# A worker does not know the WuR/BLE states its chunk starts in, so it replays
+# the chunk's first events once for every possible entry state, until the
+# state machines have synchronized (usually within one wake-up cycle), and the
+# rest of the chunk once. Composing these per-chunk summaries in order gives
+# exactly the result of a sequential replay, since times are integer ticks.
+
+MIN_CHUNK_SIZE = 1 << 20  # 1 MiB
+CHUNKS_PER_PROCESS = 4
+
+# Entry-tick placeholders filled in when chunks are composed
+ENTRY_BEFORE_CHUNK = -1   # State entered before the chunk started
+ENTRY_AT_SYNC = -2        # State entered before the synchronizing event
+
+
+def chunk_offsets(log_file_path, chunk_size=None, processes=None):
+    """
+    (start, end) byte ranges covering the log, split after a newline. A run of
+    compressed 'Times' lines is never split, since its lines expand together.
+    """
+    size = os.path.getsize(log_file_path)
+    if size == 0:
+        return []
+    if chunk_size is None:
+        chunk_size = max(MIN_CHUNK_SIZE, size // ((processes or os.cpu_count() or 1) * CHUNKS_PER_PROCESS))
+
+    ranges = []
+    with open(log_file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        start = 0
+        while start < size:
+            end = data.find(b'\n', min(start + chunk_size, size))
+            end = size if end < 0 else end + 1
+            while end < size and data[end:end + 6] == b'Times ':
+                end = data.find(b'\n', end)
+                end = size if end < 0 else end + 1
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _empty_piece(compiled, state):
+    n_machines, n_states, _ = compiled.shape
+    empty = np.empty(0, dtype=np.int64)
+    return (np.zeros(n_machines * n_states, dtype=np.int64), np.zeros(len(compiled.activity_names), dtype=np.int64),
+            empty, empty, empty, state)
+
+
+def summarize_chunk(log_file_path, start, end, scenario, first_chunk=False):
+    """
+    Replay one byte range of a log. The first chunk is replayed exactly from
+    the initial state; any other chunk is summarized for every entry state.
+    Returns None for a chunk without events.
+    """
+    compiled = load_scenario(scenario)
+    with open(log_file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        text = data[start:end].decode('utf-8', errors='replace')
+    events = list(expand_events(iter_log_lines(text.splitlines())))
+    if not events:
+        return None
+    ticks, codes, encoder = encode_events(events)
+
+    if first_chunk:
+        return {'exact': replay_codes(ticks, codes, encoder, compiled)}
+
+    n_machines = compiled.shape[0]
+    entry_states = list(product(*(range(len(states)) for states in compiled.state_names)))
+    sync = synchronizing_index(codes, encoder, compiled, entry_states)
+
+    # The chunk's first event follows an earlier one; the gap between them is charged when composing
+    prefixes = {}
+    for entry_state in entry_states:
+        state = new_state(compiled)
+        state[0] = ticks[0]
+        state[2] = 1
+        state[N_CLOCK:N_CLOCK + n_machines] = entry_state
+        state[N_CLOCK + n_machines:] = ENTRY_BEFORE_CHUNK
+        prefixes[entry_state] = (replay_codes(ticks[:sync], codes[:sync], encoder, compiled, state) if sync
+                                 else _empty_piece(compiled, state))
+
+    suffix = None
+    if sync < len(codes):
+        # Past the synchronizing event every entry state continues identically
+        state = prefixes[entry_states[0]][-1].copy()
+        state[3] = 0
+        state[N_CLOCK + n_machines:] = ENTRY_AT_SYNC
+        suffix = replay_codes(ticks[sync:], codes[sync:], encoder, compiled, state)
+
+    _, activity, _, _ = compiled.classify(encoder.descriptions)
+    return {'first_tick': int(ticks[0]), 'first_activity': int(activity[codes[0]]),
+            'prefixes': prefixes, 'suffix': suffix}
+
+
+def _summarize_job(arguments):
+    return summarize_chunk(*arguments)
+
+
+class _Composer:
+    """
+    Folds chunk summaries, in log order, into the totals of a sequential replay.
+    """
+
+    def __init__(self, scenario):
+        self.compiled = load_scenario(scenario)
+        n_machines, n_states, _ = self.compiled.shape
+        self.state_ticks = np.zeros(n_machines * n_states, dtype=np.int64)
+        self.activity_ticks = np.zeros(len(self.compiled.activity_names), dtype=np.int64)
+        self.periods = []
+        self.state = None
+
+    def _add(self, piece, placeholder=None, entries=None):
+        state_ticks, activity_ticks, machines, starts, ends, state = piece
+        self.state_ticks += state_ticks
+        self.activity_ticks += activity_ticks
+        state = state.copy()
+        if placeholder is not None:
+            starts = np.where(starts == placeholder, entries[machines], starts)
+            final_entries = state[N_CLOCK + len(entries):]
+            final_entries[final_entries == placeholder] = entries[final_entries == placeholder]
+        self.periods.append((machines, starts, ends))
+        return state
+
+    def add(self, summary):
+        if summary is None:
+            return
+        if 'exact' in summary:
+            self.state = self._add(summary['exact'])
+            return
+
+        compiled, state = self.compiled, self.state
+        n_machines, n_states, _ = compiled.shape
+        gap = summary['first_tick'] - state[0]
+        for m in range(n_machines):
+            index = m * n_states + state[N_CLOCK + m]
+            if compiled.accumulate[index]:
+                self.state_ticks[index] += gap
+        self.activity_ticks[summary['first_activity'] if compiled.attribute_to_current else state[1]] += gap
+
+        entries = state[N_CLOCK + n_machines:]
+        prefix = summary['prefixes'][tuple(int(s) for s in state[N_CLOCK:N_CLOCK + n_machines])]
+        synced = self._add(prefix, ENTRY_BEFORE_CHUNK, entries)
+        synced[3] += state[3]
+        if summary['suffix'] is None:
+            self.state = synced
+            return
+        final = self._add(summary['suffix'], ENTRY_AT_SYNC, synced[N_CLOCK + n_machines:])
+        final[3] += synced[3]
+        self.state = final
+
+    def finish(self):
+        if self.state is None:
+            return finish_replay(self.compiled, *_empty_piece(self.compiled, new_state(self.compiled)))
+        machines, starts, ends = (np.concatenate(column) for column in zip(*self.periods))
+        return finish_replay(self.compiled, self.state_ticks, self.activity_ticks, machines, starts, ends,
+                             self.state)
+
+
+def parallel_replay_log(log_file_path, scenario, processes=None, chunk_size=None):
+    """
+    Replay a state log in parallel chunks; the result is identical to
+    replayKernel.replay on the whole log.
+    """
+    ranges = chunk_offsets(log_file_path, chunk_size, processes)
+    composer = _Composer(scenario)
+    jobs = [(log_file_path, start, end, scenario, i == 0) for i, (start, end) in enumerate(ranges)]
+    with Pool(processes) as pool:
+        for (path, start, end, _, _), summary in zip(jobs, pool.imap(_summarize_job, jobs)):
+            if composer.state is None and summary is not None and 'exact' not in summary:
+                # Leading chunks had no events, so this one starts from the initial state
+                summary = summarize_chunk(path, start, end, scenario, first_chunk=True)
+            composer.add(summary)
+    return composer.finish()
@@ -0,0 +1,269 @@
+from multiprocessing import Pool
+
+import numpy as np
+
+from replayKernel import TICKS_PER_SECOND, EventEncoder, encode_events, event_powers, state_trace, to_ticks
+from scenarioEngine import NO_TRIGGER, load_scenario
+from wurSimulator import IdleRun, iter_log
+
+# Per-protocol-phase energy attribution. Every event is labelled with the phase
+# its description belongs to (the scenario's 'phases' table: WuR listening,
+# advertising/connection, service/characteristic/descriptor discovery, enabling
+# notifications, heart rate notifications, cached discovery, BLE sleep), and the
+# interval after an event belongs to that event's phase. Each event contributes
+# its BLE event power and fixed sleep charge to its own phase, and each interval
+# its machine state energy to the phase of the event that started it. All
+# contributions of a batch of runs are then summed by (run, phase, component)
+# in one np.bincount, and the totals equal those of scenario_energy.
+#
+# What a cached discovery saves is measured against the phases the scenario's
+# 'cached_discovery' entry says it replaces: the GATT discovery steps, plus
+# advertising and connection in the WuR scenarios, which skip them when cached.
+
+LOGS_PER_JOB = 16  # Logs attributed together in one worker batch
+
+
+def _run_arrays(events, encoder):
+    """
+    Tick, previous tick, code and weight arrays of one run. An IdleRun adds
+    its first cycle once and its second cycle weighted by the remaining
+    repetitions, which all replay identically.
+    """
+    pieces = []
+    pending = []
+    last_tick = 0  # The first interval runs from time 0, where replay enters the initial states
+
+    def add(ticks, codes, weight):
+        nonlocal last_tick
+        previous = np.empty_like(ticks)
+        previous[0] = last_tick
+        previous[1:] = ticks[:-1]
+        pieces.append((ticks, previous, codes, np.full(len(codes), weight, dtype=np.float64)))
+        last_tick = ticks[-1]
+
+    def flush():
+        if pending:
+            ticks, codes, _ = encode_events(pending, encoder)
+            add(ticks, codes, 1)
+            pending.clear()
+
+    for item in events:
+        if not isinstance(item, IdleRun):
+            pending.append(item)
+            continue
+        flush()
+        if not item.lines:
+            continue
+        ticks = to_ticks([item.start_time + offset for offset, _ in item.lines])
+        codes = np.fromiter((encoder.encode(description) for _, description in item.lines), dtype=np.int64,
+                            count=len(item.lines))
+        add(ticks, codes, 1)
+        if item.count > 1:
+            period_ticks = int(to_ticks(item.period))
+            add(ticks + period_ticks, codes, item.count - 1)
+            last_tick = ticks[-1] + (item.count - 1) * period_ticks
+    flush()
+
+    if not pieces:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty, np.empty(0, dtype=np.float64)
+    return tuple(np.concatenate(column) for column in zip(*pieces))
+
+
+def _columns(compiled):
+    # Contribution columns: each machine's accumulated and recorded-period energy
+    # over intervals, then BLE event power and fixed sleep phases per event. They
+    # are summed into the energy keys of scenario_energy.
+    interval_columns = [key for name in compiled.machine_names for key in (name, f'{name}_sleep')]
+    event_columns = ['BLE', 'BLE_sleep']
+    return interval_columns, event_columns
+
+
+def attribute_runs(runs, scenario, packet_lengths=None, N_channels=None, t_comm=None, sleep_duration=None):
+    """
+    Attribute the energy of a batch of runs (lists of events, IdleRun items
+    allowed) to protocol phases.
+
+    packet_lengths: optional list with one pcap {packet number: length} (or
+        None) per run; by default every packet is charged its expected length.
+
+    Returns a dict with the phase and component names, the scenario's cached
+    discovery phase and the phases it replaces, and arrays of shape
+    (runs, phases, components) for 'energy', and (runs, phases) for 'time'
+    (seconds), 'events' and 'visits' (times the phase was entered).
+    """
+    compiled = load_scenario(scenario)
+    n_machines, n_states, _ = compiled.shape
+    n_phases = len(compiled.phase_names)
+    interval_columns, event_columns = _columns(compiled)
+    components = list(dict.fromkeys(interval_columns + event_columns))
+    column_component = np.array([components.index(key) for key in interval_columns + event_columns])
+    n_interval_columns = len(interval_columns)
+    encoder = EventEncoder()
+
+    arrays = [_run_arrays(events, encoder) for events in runs]
+    lengths = np.array([len(codes) for _, _, codes, _ in arrays], dtype=np.int64)
+    ticks, previous, codes, weights = (np.concatenate(column) for column in zip(*arrays, _run_arrays([], encoder)))
+    run = np.repeat(np.arange(len(runs)), lengths)
+    first = np.zeros(len(codes), dtype=np.bool_)
+    first[np.cumsum(lengths)[lengths > 0] - lengths[lengths > 0]] = True
+
+    phase = compiled.phases(encoder.descriptions)[codes]
+    interval_phase = np.roll(phase, 1)
+    interval_phase[first] = phase[first]
+    duration = (ticks - previous) / TICKS_PER_SECOND
+
+    # Contributions of every event (rows) to every energy component (columns)
+    contributions = np.zeros((len(codes), len(column_component)))
+    if n_machines:
+        traces = [state_trace(run_codes, encoder, compiled) for _, _, run_codes, _ in arrays]
+        states = np.concatenate([trace[0] for trace in traces])
+        kept = np.concatenate([trace[1] for trace in traces])
+        for m, name in enumerate(compiled.machine_names):
+            index = m * n_states + states[:, m]
+            power = duration * compiled.current[m, states[:, m]] * compiled.voltage
+            # Replay charges accumulated states from the second event, recorded periods from time 0
+            contributions[:, 2 * m] = np.where(compiled.accumulate[index] & ~first, power, 0.0)
+            recorded = compiled.record[index] & ~compiled.accumulate[index] & kept[:, m]
+            contributions[:, 2 * m + 1] = np.where(recorded, power, 0.0)
+
+    ble = n_interval_columns
+    if packet_lengths is None:
+        contributions[:, ble] = event_powers(codes, encoder, compiled, None, N_channels, t_comm)[0]
+    else:
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        for i, run_packet_lengths in enumerate(packet_lengths):
+            contributions[offsets[i]:offsets[i + 1], ble] = event_powers(
+                codes[offsets[i]:offsets[i + 1]], encoder, compiled, run_packet_lengths, N_channels, t_comm)[0]
+
+    if compiled.fixed_sleep_trigger != NO_TRIGGER:
+        trigger, _, _, _ = compiled.classify(encoder.descriptions)
+        contributions[:, ble + 1] = np.where(trigger[codes] == compiled.fixed_sleep_trigger,
+                                             compiled.sleep_duration(sleep_duration) *
+                                             compiled.fixed_sleep_current * compiled.voltage, 0.0)
+
+    # One grouped pass: bin every contribution by (run, phase, component)
+    is_interval = np.arange(len(column_component)) < n_interval_columns
+    group = run[:, None] * n_phases + np.where(is_interval, interval_phase[:, None], phase[:, None])
+    bins = group * len(components) + column_component
+    energy = np.bincount(bins.ravel(), weights=(contributions * weights[:, None]).ravel(),
+                         minlength=len(runs) * n_phases * len(components))
+
+    group = run * n_phases
+    time = np.bincount(group + interval_phase, weights=np.where(first, 0.0, duration) * weights,
+                       minlength=len(runs) * n_phases)
+    events = np.bincount(group + phase, weights=weights, minlength=len(runs) * n_phases)
+    entered = first | (phase != np.roll(phase, 1))
+    visits = np.bincount(group + phase, weights=np.where(entered, weights, 0.0), minlength=len(runs) * n_phases)
+
+    return {'scenario': compiled.name,
+            'phases': list(compiled.phase_names),
+            'components': components,
+            'cached_discovery_phase': compiled.cached_discovery_phase,
+            'replaced_phases': list(compiled.replaced_phases),
+            'energy': energy.reshape(len(runs), n_phases, len(components)),
+            'time': time.reshape(len(runs), n_phases),
+            'events': events.reshape(len(runs), n_phases),
+            'visits': visits.reshape(len(runs), n_phases)}
+
+
+def attribute_log(log_file_path, scenario, packet_lengths=None, N_channels=None, t_comm=None):
+    """
+    Attribute the energy of one state log, optionally with its pcap packet lengths.
+    """
+    return attribute_runs([list(iter_log(log_file_path))], scenario,
+                          None if packet_lengths is None else [packet_lengths], N_channels, t_comm)
+
+
+def merge_attributions(results):
+    """
+    Stack the runs of several attributions of the same scenario.
+    """
+    results = list(results)
+    if len({(result['scenario'], tuple(result['phases'])) for result in results}) > 1:
+        raise ValueError("Cannot merge attributions of different scenarios")
+    merged = dict(results[0])
+    for key in ('energy', 'time', 'events', 'visits'):
+        merged[key] = np.concatenate([result[key] for result in results])
+    return merged
+
+
+def _attribute_logs_job(arguments):
+    log_file_paths, scenario, N_channels, t_comm = arguments
+    return attribute_runs([list(iter_log(path)) for path in log_file_paths], scenario,
+                          N_channels=N_channels, t_comm=t_comm)
+
+
+def attribute_logs(log_file_paths, scenario, N_channels=None, t_comm=None, processes=None):
+    """
+    Attribute a fleet of state logs, LOGS_PER_JOB logs per worker batch, with
+    one run per log in log order.
+    """
+    log_file_paths = list(log_file_paths)
+    jobs = [(log_file_paths[i:i + LOGS_PER_JOB], scenario, N_channels, t_comm)
+            for i in range(0, len(log_file_paths), LOGS_PER_JOB)]
+    if not jobs:
+        return attribute_runs([], scenario, N_channels=N_channels, t_comm=t_comm)
+    with Pool(processes) as pool:
+        return merge_attributions(pool.map(_attribute_logs_job, jobs))
+
+
+def phase_totals(result):
+    """
+    Energy per phase and component summed over all runs, with each phase's
+    total, share of the overall energy, time and event count.
+    """
+    energy = result['energy'].sum(axis=0)
+    total = energy.sum()
+    time = result['time'].sum(axis=0)
+    events = result['events'].sum(axis=0)
+    totals = {}
+    for p, phase in enumerate(result['phases']):
+        totals[phase] = {component: float(energy[p, c]) for c, component in enumerate(result['components'])}
+        totals[phase].update({'total': float(energy[p].sum()),
+                              'share': float(energy[p].sum() / total) if total else 0.0,
+                              'time': float(time[p]),
+                              'events': float(events[p])})
+    return totals
+
+
+def cached_discovery_savings(result):
+    """
+    Energy saved by cached discovery: the mean energy of one full discovery
+    (the phases the scenario says a cached discovery replaces) minus that of
+    one cached discovery, times the number of cached discoveries. NaN when the
+    runs hold no full discovery to compare with.
+    """
+    phases = result['phases']
+    energy = result['energy'].sum(axis=(0, 2))
+    visits = result['visits'].sum(axis=0)
+    full = [phases.index(phase) for phase in result['replaced_phases']]
+    cached = phases.index(result['cached_discovery_phase']) if result['cached_discovery_phase'] else None
+
+    # Every full discovery passes through each replaced phase once
+    full_discoveries = visits[full].min() if full else 0.0
+    cached_discoveries = visits[cached] if cached is not None else 0.0
+    full_energy = energy[full].sum() / full_discoveries if full_discoveries else np.nan
+    cached_energy = energy[cached] / cached_discoveries if cached_discoveries else 0.0
+    savings = cached_discoveries * (full_energy - cached_energy) if cached_discoveries else 0.0
+    return {'full_discoveries': float(full_discoveries),
+            'cached_discoveries': float(cached_discoveries),
+            'full_discovery_energy': float(full_energy),
+            'cached_discovery_energy': float(cached_energy),
+            'savings': float(savings),
+            'savings_share': float(savings / (energy.sum() + savings)) if energy.sum() + savings else 0.0}
+
+
+def print_phase_attribution(result):
+    """
+    Print the energy of each phase and the savings of cached discovery.
+    """
+    totals = phase_totals(result)
+    print(f"Scenario: {result['scenario']} ({len(result['energy'])} runs)")
+    for phase, values in sorted(totals.items(), key=lambda item: -item[1]['total']):
+        print(f"{phase:<26} {values['total']:.6e} ({values['share']:6.2%}), "
+              f"{values['time']:.0f}s, {values['events']:.0f} events")
+    savings = cached_discovery_savings(result)
+    print(f"Cached discovery: {savings['cached_discoveries']:.0f} uses at {savings['cached_discovery_energy']:.6e} "
+          f"instead of {savings['full_discovery_energy']:.6e}, saving {savings['savings']:.6e} "
+          f"({savings['savings_share']:.2%} of the energy without caching)")
@@ -0,0 +1,72 @@
+from replayKernel import (encode_events, event_charges, log_times, machine_currents, read_log, replay,
+                          replay_events, scenario_energy)
+from scenarioEngine import load_scenario
+
+# Energy accounting of simulated runs and recorded logs. The currents, voltage,
+# expected PDU lengths and the N_channels/t_comm defaults all come from the
+# scenario definitions in scenarios/ (ble_common holds the shared BLE radio), so
+# editing a scenario file changes every consumer: these functions, the job
+# server and the *_powerCompute.py scripts. Simulated runs have no pcap, so
+# every packet event is charged its expected length.
+
+
+def parse_events(events, scenario):
+    """
+    Replay simulated events and return WuR_times, BLE_times and ble_sleep_periods.
+    Compressed IdleRun items from fast-forward runs are accounted without expansion.
+    """
+    result, _ = replay_events(events, scenario)
+    return log_times(result)
+
+
+def compute_energy(events, scenario, N_channels=None, t_comm=None, sleep_duration=None):
+    """
+    Total WuR, BLE and BLE sleep consumption of a simulated run, in the units of
+    the power-compute scripts (current x voltage, summed over seconds or events).
+    The scenario's definition in scenarios/ decides how each event is charged;
+    N_channels and t_comm default to the scenario's parameters, and
+    sleep_duration overrides the length of its fixed sleep phases.
+    """
+    result, total_power_BLE = replay_events(events, scenario, N_channels, t_comm)
+    return scenario_energy(scenario, result, total_power_BLE, sleep_duration)
+
+
+def log_power(log_file_path, scenario, packet_lengths=None, N_channels=None, t_comm=None, sleep_duration=None):
+    """
+    Replay a state log and charge its events as the power-compute scripts do.
+    Returns a dict with
+        events: plain (time, description) events of the log
+        result: the replay result (see replayKernel.finish_replay)
+        energy: scenario_energy totals
+        power_times: {time: BLE power} of every charged event (the last one
+            at a time wins)
+        power_per_packet: {time: BLE power} of events matched to a packet
+        current_times: {machine: {time: current (A) after the event}}
+    packet_lengths are the pcap {packet number: length}, None for simulated logs.
+    """
+    compiled = load_scenario(scenario)
+    events = read_log(log_file_path)
+    ticks, codes, encoder = encode_events(events)
+    result = replay(ticks, codes, encoder, compiled)
+    power, charged, total_power_BLE = event_charges(codes, encoder, compiled, packet_lengths, N_channels, t_comm)
+    _, _, _, uncharged = compiled.classify(encoder.descriptions)
+    currents = machine_currents(codes, encoder, compiled)
+
+    power_times = {}
+    power_per_packet = {}
+    current_times = {name: {} for name in compiled.machine_names}
+    for i, (time_sec, _) in enumerate(events):
+        for m, name in enumerate(compiled.machine_names):
+            current_times[name][time_sec] = float(currents[i, m])
+        if uncharged[codes[i]]:
+            continue
+        power_times[time_sec] = float(power[i])
+        if charged[i] > 0:
+            power_per_packet[time_sec] = float(power[i])
+
+    return {'events': events,
+            'result': result,
+            'energy': scenario_energy(compiled, result, total_power_BLE, sleep_duration),
+            'power_times': power_times,
+            'power_per_packet': power_per_packet,
+            'current_times': current_times}
@@ -0,0 +1,118 @@
+import math
+import numpy as np
+
+from replayKernel import EventEncoder, event_powers
+from wurSimulator import (SIMULATION_TIME_LIMIT, DEVICE_FORGOTTEN, HEART_RATE_NOTIFICATION, IdleRun,
+                          scenario_reconnection_probability, simulate)
+
+# Rare-event mode for reconnections. Runs are simulated with a raised
+# reconnection probability q instead of the true p and reweighted with the
+# likelihood ratio of the reconnection draws,
+#     L = (p / q)^k * ((1 - p) / (1 - q))^(n - k)
+# for k reconnections in n checks. E_q[L * Y] = E_p[Y] for any run quantity Y,
+# so the weighted mean is an unbiased estimate under the true probability.
+
+# The likelihood ratio multiplies over every reconnection check in a run, so
+# boosting p too far makes the weights degenerate. By default q is chosen for
+# about TARGET_RECONNECTIONS reconnections per run, which keeps E_q[L^2] near e.
+TARGET_RECONNECTIONS = 1.0
+MAX_PROPOSAL_PROBABILITY = 0.5
+
+
+def reconnection_energy(events, scenario):
+    """
+    BLE energy spent on reconnection-triggered rediscovery: every event
+    between 'Device forgotten' and the heart rate notification, charged as the
+    scenario charges it.
+    """
+    encoder = EventEncoder()
+    codes = []
+    in_reconnection = False
+    for item in events:
+        if isinstance(item, IdleRun):
+            continue
+        description = item[1]
+        if DEVICE_FORGOTTEN in description:
+            in_reconnection = True
+        elif in_reconnection and HEART_RATE_NOTIFICATION in description:
+            in_reconnection = False
+        elif in_reconnection:
+            codes.append(encoder.encode(description))
+    return event_powers(np.array(codes, dtype=np.int64), encoder, scenario)[1]
+
+
+def log_likelihood_ratio(reconnections, trials, p, q):
+    """
+    Log of the likelihood ratio of a run's reconnection draws under p versus q.
+    """
+    return (reconnections * (math.log(p) - math.log(q)) +
+            (trials - reconnections) * (math.log1p(-p) - math.log1p(-q)))
+
+
+def default_proposal_probability(scenario, time_limit, rng, **simulate_kwargs):
+    """
+    Proposal probability giving about TARGET_RECONNECTIONS per run, sized from
+    the number of reconnection checks in a pilot run.
+    """
+    p = scenario_reconnection_probability(scenario)
+    pilot = simulate(scenario, time_limit=time_limit, rng=rng, reconnection_probability=0.0, **simulate_kwargs)
+    q = TARGET_RECONNECTIONS / max(pilot['reconnection_trials'], 1)
+    return min(MAX_PROPOSAL_PROBABILITY, max(p, q))
+
+
+def estimate_reconnection_energy(scenario, runs=200, time_limit=SIMULATION_TIME_LIMIT,
+                                 proposal_probability=None, seed=None, **simulate_kwargs):
+    """
+    Importance-sampling estimate of the expected reconnection energy per run.
+
+    Returns the estimate with its variance and standard error, the likelihood
+    ratio diagnostics (mean should be close to 1) and the simulated seconds spent.
+    """
+    p = scenario_reconnection_probability(scenario)
+    if p <= 0:
+        raise ValueError(f"Scenario {scenario!r} has no random reconnections")
+
+    rng = np.random.default_rng(seed)
+    if proposal_probability is None:
+        proposal_probability = default_proposal_probability(scenario, time_limit, rng, **simulate_kwargs)
+    q = proposal_probability
+    weights = np.empty(runs)
+    energies = np.empty(runs)
+    reconnections = 0
+    simulated_seconds = 0
+
+    for i in range(runs):
+        run = simulate(scenario, time_limit=time_limit, rng=rng, reconnection_probability=q, **simulate_kwargs)
+        weights[i] = math.exp(log_likelihood_ratio(run['reconnections'], run['reconnection_trials'], p, q))
+        energies[i] = reconnection_energy(run['events'], scenario)
+        reconnections += run['reconnections']
+        simulated_seconds += run['duration']
+
+    weighted = weights * energies
+    estimate = weighted.mean()
+    variance = weighted.var(ddof=1) / runs if runs > 1 else float('nan')
+
+    return {'scenario': scenario,
+            'estimate': estimate,
+            'variance': variance,
+            'std_error': math.sqrt(variance),
+            'relative_error': math.sqrt(variance) / estimate if estimate else float('nan'),
+            'runs': runs,
+            'true_probability': p,
+            'proposal_probability': q,
+            'proposal_reconnections': reconnections,
+            'likelihood_ratio_mean': weights.mean(),
+            'effective_sample_size': weights.sum() ** 2 / np.square(weights).sum(),
+            'simulated_seconds': simulated_seconds}
+
+
+def print_estimate(result):
+    """
+    Print a rare-event estimate with its stated variance.
+    """
+    print(f"Scenario: {result['scenario']} (p = {result['true_probability']:g}, q = {result['proposal_probability']:g})")
+    print(f"Reconnection energy per run: {result['estimate']:.6e} ± {result['std_error']:.2e} "
+          f"(variance {result['variance']:.3e}, relative error {result['relative_error']:.1%})")
+    print(f"Likelihood ratio mean: {result['likelihood_ratio_mean']:.3f}, "
+          f"effective sample size: {result['effective_sample_size']:.1f} of {result['runs']}")
+    print(f"Simulated seconds: {result['simulated_seconds']}")
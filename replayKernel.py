@@ -0,0 +1,526 @@
+import numpy as np
+
+from scenarioEngine import NO_TRIGGER, load_scenario
+from wurSimulator import IdleRun, expand_events, iter_log
+
+# Compiled log replay. Event descriptions are encoded once into small integer
+# codes, a compiled scenario (scenarioEngine) classifies each code into lookup
+# tables, and the state transitions and power assignment run as tight loops over
+# the code arrays. With Numba installed the loops are JIT-compiled to machine
+# code; without it the same functions run as plain Python.
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda function: function
+
+TICKS_PER_SECOND = 1000  # Times are replayed as integer milliseconds so sums are exact
+
+# Replay state carried between calls, so a log can be replayed in pieces:
+# [previous_tick, previous_activity, has_previous, fixed_sleep_phases,
+#  state of each machine..., entry tick of each machine...]
+CLOCK_FIELDS = ('previous_tick', 'previous_activity', 'has_previous', 'fixed_sleep_phases')
+N_CLOCK = len(CLOCK_FIELDS)
+
+
+class EventEncoder:
+    """
+    Maps event descriptions to integer codes, in order of first appearance.
+    """
+
+    def __init__(self):
+        self.codes = {}
+        self.descriptions = []
+
+    def encode(self, description):
+        code = self.codes.get(description)
+        if code is None:
+            code = len(self.descriptions)
+            self.codes[description] = code
+            self.descriptions.append(description)
+        return code
+
+
+def to_ticks(times):
+    return np.rint(np.asarray(times, dtype=np.float64) * TICKS_PER_SECOND).astype(np.int64)
+
+
+def _seconds(ticks):
+    value = ticks / TICKS_PER_SECOND
+    return int(value) if value.is_integer() else value
+
+
+def encode_events(events, encoder=None):
+    """
+    Encode (time, description) events, expanding IdleRun items, into an int64
+    tick array and an int64 code array.
+    """
+    encoder = encoder or EventEncoder()
+    if any(isinstance(item, IdleRun) for item in events):
+        events = list(expand_events(events))
+    ticks = to_ticks([time_sec for time_sec, _ in events])
+    codes = np.fromiter((encoder.encode(description) for _, description in events), dtype=np.int64,
+                        count=len(events))
+    return ticks, codes, encoder
+
+
+def encode_log(log_file_path, encoder=None):
+    """
+    Read a state log (compressed 'Times' lines included) straight into code arrays.
+    """
+    return encode_events(list(iter_log(log_file_path)), encoder)
+
+
+def new_state(scenario):
+    """
+    Initial replay state: every machine in its initial state since time 0, no events yet.
+    """
+    compiled = load_scenario(scenario)
+    n_machines = len(compiled.machine_names)
+    state = np.zeros(N_CLOCK + 2 * n_machines, dtype=np.int64)
+    state[1] = compiled.idle_activity
+    state[N_CLOCK:N_CLOCK + n_machines] = compiled.initial
+    return state
+
+
+@njit(cache=True)
+def _replay_kernel(ticks, codes, trigger, activity, next_state, accumulate, record, n_machines, n_states, n_triggers,
+                   attribute_to_current, fixed_sleep_trigger, state, state_ticks, activity_ticks,
+                   period_machines, period_starts, period_ends):
+    previous_tick = state[0]
+    previous_activity = state[1]
+    has_previous = state[2]
+    fixed_sleep_phases = state[3]
+    entries = N_CLOCK + n_machines
+    n_periods = 0
+
+    for i in range(len(codes)):
+        tick = ticks[i]
+        code = codes[i]
+        t = trigger[code]
+
+        if t != NO_TRIGGER and t == fixed_sleep_trigger:
+            fixed_sleep_phases += 1
+
+        if has_previous:
+            duration = tick - previous_tick
+
+            # Time since the previous event is charged to the states before this event's transitions
+            for m in range(n_machines):
+                index = m * n_states + state[N_CLOCK + m]
+                if accumulate[index]:
+                    state_ticks[index] += duration
+
+            if t != NO_TRIGGER:
+                for m in range(n_machines):
+                    s = state[N_CLOCK + m]
+                    target = next_state[(m * n_states + s) * n_triggers + t]
+                    if target >= 0:
+                        if target != s and record[m * n_states + s]:
+                            period_machines[n_periods] = m
+                            period_starts[n_periods] = state[entries + m]
+                            period_ends[n_periods] = tick
+                            n_periods += 1
+                        state[N_CLOCK + m] = target
+                        state[entries + m] = tick
+
+            if attribute_to_current:
+                activity_ticks[activity[code]] += duration
+            else:
+                activity_ticks[previous_activity] += duration
+
+        previous_tick = tick
+        previous_activity = activity[code]
+        has_previous = 1
+
+    state[0] = previous_tick
+    state[1] = previous_activity
+    state[2] = has_previous
+    state[3] = fixed_sleep_phases
+    return n_periods
+
+
+@njit(cache=True)
+def _power_kernel(codes, activity, length_table, uncharged, activity_coefficient, idle_power,
+                  pcap_lengths, use_expected, packet_counter, power, charged):
+    total_power_BLE = 0.0
+    for i in range(len(codes)):
+        code = codes[i]
+        if uncharged[code]:
+            power[i] = 0.0
+            charged[i] = 0
+            continue
+
+        length = 0
+        expected = length_table[code]
+        if expected > 0:
+            if use_expected:
+                length = expected
+            elif packet_counter <= len(pcap_lengths):
+                captured = pcap_lengths[packet_counter - 1]
+                if captured > 0 and abs(captured - expected) <= 2:
+                    length = captured
+
+        if length > 0:
+            value = activity_coefficient[activity[code]] * length
+            packet_counter += 1
+        else:
+            value = idle_power
+        power[i] = value
+        charged[i] = length
+        total_power_BLE += value
+    return total_power_BLE, packet_counter
+
+
+@njit(cache=True)
+def _synchronize_kernel(codes, trigger, next_state, n_machines, n_states, n_triggers, states):
+    n_entries = len(states) // n_machines
+    for i in range(len(codes)):
+        synchronized = True
+        for e in range(1, n_entries):
+            for m in range(n_machines):
+                if states[e * n_machines + m] != states[m]:
+                    synchronized = False
+        if synchronized:
+            return i
+
+        t = trigger[codes[i]]
+        if t != NO_TRIGGER:
+            for e in range(n_entries):
+                for m in range(n_machines):
+                    s = states[e * n_machines + m]
+                    target = next_state[(m * n_states + s) * n_triggers + t]
+                    if target >= 0:
+                        states[e * n_machines + m] = target
+    return len(codes)
+
+
+@njit(cache=True)
+def _trace_kernel(codes, trigger, next_state, record, n_machines, n_states, n_triggers, current, states, kept):
+    # Interval i ends at event i; interval 0 runs from time 0 to the first event
+    entry_interval = np.zeros(n_machines, dtype=np.int64)
+    for i in range(len(codes)):
+        for m in range(n_machines):
+            states[i * n_machines + m] = current[m]
+        t = trigger[codes[i]]
+        if i == 0 or t == NO_TRIGGER:
+            continue
+        for m in range(n_machines):
+            s = current[m]
+            target = next_state[(m * n_states + s) * n_triggers + t]
+            if target >= 0:
+                if target == s and record[m * n_states + s]:
+                    # Re-entering a recorded state restarts its period; the stay so far is never recorded
+                    for k in range(entry_interval[m], i + 1):
+                        kept[k * n_machines + m] = 0
+                current[m] = target
+                entry_interval[m] = i + 1
+
+
+def _kernel_arguments(*arguments):
+    # Without Numba the kernels index plain lists, which is much faster than
+    # indexing NumPy arrays element by element from Python
+    if HAVE_NUMBA:
+        return list(arguments)
+    return [argument.tolist() if isinstance(argument, np.ndarray) else argument for argument in arguments]
+
+
+def replay_codes(ticks, codes, encoder, scenario, state=None):
+    """
+    Run a scenario's transition tables over code arrays.
+
+    Returns the time in ticks spent in each (machine, state) (flattened M x S),
+    the time in ticks of each BLE activity, the periods closed in this piece as
+    (machine, start tick, end tick) arrays, and the updated state. Pass the
+    returned state back in to continue with the next piece of the same log.
+    """
+    compiled = load_scenario(scenario)
+    trigger, activity, _, _ = compiled.classify(encoder.descriptions)
+    n_machines, n_states, n_triggers = compiled.shape
+    state = new_state(compiled) if state is None else state.copy()
+    capacity = len(codes) * n_machines
+
+    arguments = _kernel_arguments(ticks, codes, trigger, activity, compiled.next_state, compiled.accumulate,
+                                  compiled.record, n_machines, n_states, n_triggers, compiled.attribute_to_current,
+                                  compiled.fixed_sleep_trigger, state,
+                                  np.zeros(n_machines * n_states, dtype=np.int64),
+                                  np.zeros(len(compiled.activity_names), dtype=np.int64),
+                                  np.empty(capacity, dtype=np.int64), np.empty(capacity, dtype=np.int64),
+                                  np.empty(capacity, dtype=np.int64))
+    n_periods = _replay_kernel(*arguments)
+    state, state_ticks, activity_ticks, period_machines, period_starts, period_ends = (
+        np.asarray(argument, dtype=np.int64) for argument in arguments[12:])
+    return (state_ticks, activity_ticks,
+            period_machines[:n_periods], period_starts[:n_periods], period_ends[:n_periods], state)
+
+
+def synchronizing_index(codes, encoder, scenario, entry_states):
+    """
+    Number of leading events after which every one of the given entry states
+    (rows of machine states) has been driven into the same machine states, or
+    len(codes) if they never meet. Events are taken to follow earlier ones, so
+    the first event's transitions apply.
+    """
+    compiled = load_scenario(scenario)
+    trigger, _, _, _ = compiled.classify(encoder.descriptions)
+    n_machines, n_states, n_triggers = compiled.shape
+    if n_machines == 0 or len(entry_states) < 2:
+        return 0
+    arguments = _kernel_arguments(codes, trigger, compiled.next_state, n_machines, n_states, n_triggers,
+                                  np.asarray(entry_states, dtype=np.int64).ravel())
+    return _synchronize_kernel(*arguments)
+
+
+def state_trace(codes, encoder, scenario):
+    """
+    Machine states of one run during the interval ending at each event (before
+    the event's transitions), as an (events, machines) array, and whether each
+    interval counts towards its recorded state's periods. Like replay, the
+    first event's transitions are not applied.
+    """
+    compiled = load_scenario(scenario)
+    trigger, _, _, _ = compiled.classify(encoder.descriptions)
+    n_machines, n_states, n_triggers = compiled.shape
+    arguments = _kernel_arguments(codes, trigger, compiled.next_state, compiled.record, n_machines, n_states,
+                                  n_triggers, compiled.initial.copy(),
+                                  np.empty(len(codes) * n_machines, dtype=np.int64),
+                                  np.ones(len(codes) * n_machines, dtype=np.bool_))
+    _trace_kernel(*arguments)
+    states = np.asarray(arguments[8], dtype=np.int64).reshape(len(codes), n_machines)
+    kept = np.asarray(arguments[9], dtype=np.bool_).reshape(len(codes), n_machines)
+    return states, kept
+
+
+def machine_currents(codes, encoder, scenario):
+    """
+    Current drawn by each machine right after each event, as an (events,
+    machines) array. Like replay, the first event's transitions are not applied.
+    """
+    compiled = load_scenario(scenario)
+    codes = np.asarray(codes, dtype=np.int64)
+    if len(codes) == 0:
+        return np.zeros((0, compiled.shape[0]))
+    # The trace holds the states before each event; a repeated last code yields the state after it
+    states, _ = state_trace(np.append(codes, codes[-1]), encoder, compiled)
+    return compiled.current[np.arange(compiled.shape[0]), states[1:]]
+
+
+def event_powers(codes, encoder, scenario, packet_lengths=None, N_channels=None, t_comm=None):
+    """
+    BLE power of every event and their total, as assigned by calculate_power.
+    """
+    power, _, total_power_BLE = event_charges(codes, encoder, scenario, packet_lengths, N_channels, t_comm)
+    return power, total_power_BLE
+
+
+def event_charges(codes, encoder, scenario, packet_lengths=None, N_channels=None, t_comm=None):
+    """
+    BLE power of every event, the packet length it was charged for (0 if it was
+    not matched to a packet) and the total power.
+
+    packet_lengths: pcap {packet number: length}, matched in order against each
+        packet event's expected length (+/- 2 bytes); None charges every packet
+        event its expected length, as for simulated runs.
+    Events the scenario lists as uncharged get power 0.
+    """
+    compiled = load_scenario(scenario)
+    N_channels = compiled.parameters['N_channels'] if N_channels is None else N_channels
+    t_comm = compiled.parameters['t_comm'] if t_comm is None else t_comm
+    _, activity, length_table, uncharged = compiled.classify(encoder.descriptions)
+
+    activity_coefficient = compiled.activity_current * N_channels * compiled.voltage / t_comm
+    activity_coefficient[compiled.idle_activity] = 0.0
+    idle_power = compiled.activity_current[compiled.idle_activity] * compiled.voltage
+    if packet_lengths:
+        pcap_lengths = np.zeros(max(packet_lengths), dtype=np.int64)
+        for number, length in packet_lengths.items():
+            pcap_lengths[number - 1] = length
+    else:
+        pcap_lengths = np.zeros(0, dtype=np.int64)
+
+    arguments = _kernel_arguments(codes, activity, length_table, uncharged, activity_coefficient, idle_power,
+                                  pcap_lengths, packet_lengths is None, 1, np.empty(len(codes), dtype=np.float64),
+                                  np.empty(len(codes), dtype=np.int64))
+    total_power_BLE, _ = _power_kernel(*arguments)
+    return (np.asarray(arguments[-2], dtype=np.float64), np.asarray(arguments[-1], dtype=np.int64),
+            total_power_BLE)
+
+
+def finish_replay(scenario, state_ticks, activity_ticks, period_machines, period_starts, period_ends, state):
+    """
+    Close a replay and convert it to seconds. Returns a dict with
+    'state_times' {machine: {state: seconds}}, 'activity_times' {activity:
+    seconds}, 'periods' {machine: [(start, end)]} and 'fixed_sleep_phases'.
+    """
+    compiled = load_scenario(scenario)
+    n_machines, n_states, _ = compiled.shape
+    periods = {name: [] for name in compiled.machine_names}
+    for m, start, end in zip(period_machines.tolist(), period_starts.tolist(), period_ends.tolist()):
+        periods[compiled.machine_names[m]].append((_seconds(start), _seconds(end)))
+
+    # As in parse_log_file, a machine still in a recorded state stays there until the last event
+    if state[2]:
+        for m, name in enumerate(compiled.machine_names):
+            if compiled.record[m * n_states + state[N_CLOCK + m]]:
+                periods[name].append((_seconds(int(state[N_CLOCK + n_machines + m])), _seconds(int(state[0]))))
+
+    return {'state_times': {name: {state_name: _seconds(int(state_ticks[m * n_states + s]))
+                                   for s, state_name in enumerate(compiled.state_names[m])}
+                            for m, name in enumerate(compiled.machine_names)},
+            'activity_times': {name: _seconds(int(activity_ticks[a]))
+                               for a, name in enumerate(compiled.activity_names)},
+            'periods': periods,
+            'fixed_sleep_phases': int(state[3])}
+
+
+def replay(ticks, codes, encoder, scenario):
+    """
+    Replay a whole log held in code arrays.
+    """
+    return finish_replay(scenario, *replay_codes(ticks, codes, encoder, scenario))
+
+
+def replay_events(events, scenario, N_channels=None, t_comm=None):
+    """
+    Replay simulated events without expanding compressed IdleRun items and
+    return (replay result, total BLE event power). Idle cycles leave the state
+    where they found it after the first repetition, so the second repetition's
+    increments apply to every later one.
+    """
+    compiled = load_scenario(scenario)
+    encoder = EventEncoder()
+    state = new_state(compiled)
+    state_ticks = np.zeros(compiled.shape[0] * compiled.shape[1], dtype=np.int64)
+    activity_ticks = np.zeros(len(compiled.activity_names), dtype=np.int64)
+    periods = []
+    plain_codes = []       # Codes of uncompressed events, charged in one pass at the end
+    idle_power = {}        # BLE power of one repetition of each distinct idle cycle
+    total_power_BLE = 0.0
+
+    def run(ticks, codes, repeats=1, period_ticks=0):
+        nonlocal state, state_ticks, activity_ticks
+        piece_ticks, piece_activity, machines, starts, ends, state = replay_codes(ticks, codes, encoder, compiled,
+                                                                                 state)
+        state_ticks = state_ticks + piece_ticks * repeats
+        activity_ticks = activity_ticks + piece_activity * repeats
+        if len(machines):
+            for k in range(repeats):
+                periods.append((machines, starts + k * period_ticks, ends + k * period_ticks))
+
+    pending = []
+
+    def flush():
+        if pending:
+            ticks, codes, _ = encode_events(pending, encoder)
+            run(ticks, codes)
+            plain_codes.append(codes)
+            pending.clear()
+
+    for item in events:
+        if not isinstance(item, IdleRun):
+            pending.append(item)
+            continue
+        flush()
+        if not item.lines:
+            continue
+        offsets = to_ticks([item.start_time + offset for offset, _ in item.lines])
+        codes = np.fromiter((encoder.encode(description) for _, description in item.lines), dtype=np.int64,
+                            count=len(item.lines))
+        period_ticks = int(to_ticks(item.period))
+        run(offsets, codes)
+        if item.count > 1:
+            cycle_start = offsets[0] + period_ticks
+            run(offsets + period_ticks, codes, item.count - 1, period_ticks)
+            # Move the clock and any entry times set in the measured cycle to the last repetition
+            shift = (item.count - 2) * period_ticks
+            state[0] += shift
+            entries = state[N_CLOCK + compiled.shape[0]:]
+            entries[entries >= cycle_start] += shift
+        if item.lines not in idle_power:
+            idle_power[item.lines] = event_powers(codes, encoder, compiled, None, N_channels, t_comm)[1]
+        total_power_BLE += item.count * idle_power[item.lines]
+    flush()
+    if plain_codes:
+        total_power_BLE += event_powers(np.concatenate(plain_codes), encoder, compiled, None, N_channels, t_comm)[1]
+
+    if periods:
+        machines, starts, ends = (np.concatenate(column) for column in zip(*periods))
+        order = np.argsort(ends, kind='stable')
+        machines, starts, ends = machines[order], starts[order], ends[order]
+    else:
+        machines = starts = ends = np.empty(0, dtype=np.int64)
+    return finish_replay(compiled, state_ticks, activity_ticks, machines, starts, ends, state), total_power_BLE
+
+
+def log_times(result):
+    """
+    parse_log_file style WuR_times, BLE_times and ble_sleep_periods of a replay result.
+    """
+    return result['state_times'].get('WuR', {}), result['activity_times'], result['periods'].get('BLE', [])
+
+
+def scenario_energy(scenario, result, total_power_BLE, sleep_duration=None):
+    """
+    Consumption of a replayed run in the units of the power-compute scripts
+    (current x voltage, summed over seconds or events). Each machine is charged
+    for its accumulated state times under its own name and for its recorded,
+    non-accumulated periods under '<machine>_sleep'; fixed sleep phases count as
+    'BLE_sleep'.
+    """
+    compiled = load_scenario(scenario)
+    n_states = compiled.shape[1]
+    energy = {'WuR': 0.0, 'BLE': total_power_BLE, 'BLE_sleep': 0.0}
+    for m, name in enumerate(compiled.machine_names):
+        state_index = {state_name: s for s, state_name in enumerate(compiled.state_names[m])}
+        accumulated = sum(seconds * compiled.current[m, state_index[state_name]]
+                          for state_name, seconds in result['state_times'][name].items())
+        energy[name] = energy.get(name, 0.0) + accumulated * compiled.voltage
+
+        recorded = [s for s in range(len(compiled.state_names[m]))
+                    if compiled.record[m * n_states + s] and not compiled.accumulate[m * n_states + s]]
+        if recorded:
+            # Periods are recorded from a single state per machine in every bundled scenario
+            current = compiled.current[m, recorded[0]]
+            sleep_time = sum(end - start for start, end in result['periods'][name])
+            energy[f'{name}_sleep'] = energy.get(f'{name}_sleep', 0.0) + sleep_time * current * compiled.voltage
+
+    if compiled.fixed_sleep_trigger != NO_TRIGGER:
+        energy['BLE_sleep'] += (result['fixed_sleep_phases'] * compiled.sleep_duration(sleep_duration) *
+                                compiled.fixed_sleep_current * compiled.voltage)
+    energy = {key: float(value) for key, value in energy.items()}
+    energy['total'] = sum(energy.values())
+    return energy
+
+
+def read_log(log_file_path):
+    """
+    Plain (time, description) events of a state log, with idle runs expanded.
+    """
+    return list(expand_events(iter_log(log_file_path)))
+
+
+def parse_log(log_file_path, scenario):
+    """
+    Read a state log and replay it with a scenario's tables. Returns the plain
+    (time, description) events and the replay result.
+    """
+    events = read_log(log_file_path)
+    ticks, codes, encoder = encode_events(events)
+    return events, replay(ticks, codes, encoder, scenario)
+
+
+def replay_log(log_file_path, scenario, packet_lengths=None, N_channels=None, t_comm=None):
+    """
+    Compiled equivalent of parse_log_file followed by the BLE part of
+    calculate_power. Returns the replay result and total_power_BLE.
+    """
+    ticks, codes, encoder = encode_log(log_file_path)
+    result = replay(ticks, codes, encoder, scenario)
+    _, total_power_BLE = event_powers(codes, encoder, scenario, packet_lengths, N_channels, t_comm)
+    return result, total_power_BLE
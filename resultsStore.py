@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+# Local results database. Every simulation or power-compute run is recorded with
+# its scenario, parameters, input file hashes, totals and summary statistics,
+# instead of overwriting loose CSV files. The configuration columns are indexed
+# so questions like "lowest-energy dcw runs with wake_up_interval <= 5" stay fast
+# across tens of thousands of runs.
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.db')
+RESULTS_DB_ENV = 'WUR_RESULTS_DB'  # Environment variable overriding DEFAULT_DB_PATH
+
+BUSY_TIMEOUT_MS = 30000  # How long a writer waits for another worker's insert
+
+# Indexed configuration columns, filled from the run parameters of the same name
+CONFIG_COLUMNS = ['wake_up_interval', 'sleep_duration', 'reconnection_probability',
+                  'time_limit', 'N_channels', 't_comm', 'seed']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    scenario TEXT NOT NULL,
+    source TEXT NOT NULL,
+    wake_up_interval REAL,
+    sleep_duration REAL,
+    reconnection_probability REAL,
+    time_limit REAL,
+    N_channels INTEGER,
+    t_comm REAL,
+    seed INTEGER,
+    parameters TEXT NOT NULL,
+    input_hashes TEXT NOT NULL,
+    total_power_WuR REAL,
+    total_power_BLE REAL,
+    total_ble_sleep_power REAL,
+    total_energy REAL,
+    summary TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_runs_scenario_energy ON runs (scenario, total_energy);
+CREATE INDEX IF NOT EXISTS idx_runs_wake_up_interval ON runs (scenario, wake_up_interval, total_energy);
+CREATE INDEX IF NOT EXISTS idx_runs_sleep_duration ON runs (scenario, sleep_duration, total_energy);
+CREATE INDEX IF NOT EXISTS idx_runs_reconnection ON runs (scenario, reconnection_probability);
+CREATE INDEX IF NOT EXISTS idx_runs_channels ON runs (N_channels, t_comm);
+"""
+
+_hash_cache = {}
+
+
+def default_db_path():
+    """
+    Database path used when none is given: $WUR_RESULTS_DB if set, else DEFAULT_DB_PATH.
+    """
+    return os.environ.get(RESULTS_DB_ENV) or DEFAULT_DB_PATH
+
+
+def file_hash(path, block_size=1 << 20):
+    """
+    SHA-256 of a file, cached per (path, size, mtime) so repeated runs on the
+    same inputs do not re-read them.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _hash_cache:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(block_size), b''):
+                digest.update(block)
+        _hash_cache[key] = digest.hexdigest()
+    return _hash_cache[key]
+
+
+class ResultsStore:
+    """
+    SQLite store of run results. The database runs in WAL mode with a busy
+    timeout, so batch workers can each open their own ResultsStore on the same
+    file and insert concurrently while readers keep querying.
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = default_db_path() if db_path is None else db_path
+        self.connection = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _row(self, scenario, parameters, totals, input_files=(), summary=None, source='simulation'):
+        row = {column: parameters.get(column) for column in CONFIG_COLUMNS}
+        row.update({
+            'created_at': time.time(),
+            'scenario': scenario,
+            'source': source,
+            'parameters': json.dumps(parameters, sort_keys=True, default=str),
+            'input_hashes': json.dumps({os.path.basename(path): file_hash(path) for path in input_files},
+                                       sort_keys=True),
+            'total_power_WuR': totals.get('WuR'),
+            'total_power_BLE': totals.get('BLE'),
+            'total_ble_sleep_power': totals.get('BLE_sleep'),
+            'total_energy': totals.get('total'),
+            'summary': json.dumps(summary or {}, sort_keys=True, default=str)
+        })
+        return row
+
+    def _insert(self, row):
+        columns = ', '.join(row)
+        placeholders = ', '.join(f':{column}' for column in row)
+        return self.connection.execute(f'INSERT INTO runs ({columns}) VALUES ({placeholders})', row).lastrowid
+
+    def record_run(self, scenario, parameters, totals, input_files=(), summary=None, source='simulation'):
+        """
+        Insert one run and return its id.
+
+        parameters: dict of run parameters; CONFIG_COLUMNS found here are also
+            stored in their own indexed columns.
+        totals: dict with 'WuR', 'BLE', 'BLE_sleep' and 'total' (as returned
+            by powerModel.compute_energy).
+        input_files: paths of the log, pcap or trace files the run read.
+        """
+        with self.connection:
+            return self._insert(self._row(scenario, parameters, totals, input_files, summary, source))
+
+    def record_runs(self, runs):
+        """
+        Insert many (scenario, parameters, totals[, input_files[, summary]])
+        runs in a single transaction and return their ids.
+        """
+        with self.connection:
+            return [self._insert(self._row(*run)) for run in runs]
+
+    def find_runs(self, scenario=None, order_by='total_energy', limit=None, **ranges):
+        """
+        Query runs. Each keyword names a configuration column and gives a value
+        or a (low, high) range, either bound may be None, e.g.
+        find_runs('dcw', wake_up_interval=(None, 5), limit=10).
+        """
+        if order_by not in ('total_energy', 'created_at', 'id') + tuple(CONFIG_COLUMNS):
+            raise ValueError(f"Cannot order runs by {order_by!r}")
+
+        clauses, values = [], []
+        if scenario is not None:
+            clauses.append('scenario = ?')
+            values.append(scenario)
+        for column, bounds in ranges.items():
+            if column not in CONFIG_COLUMNS:
+                raise ValueError(f"{column!r} is not an indexed configuration column")
+            if isinstance(bounds, tuple):
+                low, high = bounds
+                if low is not None:
+                    clauses.append(f'{column} >= ?')
+                    values.append(low)
+                if high is not None:
+                    clauses.append(f'{column} <= ?')
+                    values.append(high)
+            else:
+                clauses.append(f'{column} = ?')
+                values.append(bounds)
+
+        query = 'SELECT * FROM runs'
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        query += f' ORDER BY {order_by}'
+        if limit is not None:
+            query += ' LIMIT ?'
+            values.append(limit)
+
+        runs = []
+        for row in self.connection.execute(query, values):
+            run = dict(row)
+            for column in ('parameters', 'input_hashes', 'summary'):
+                run[column] = json.loads(run[column])
+            runs.append(run)
+        return runs
+
+
+def record_run(scenario, parameters, totals, input_files=(), summary=None, source='simulation',
+               db_path=None):
+    """
+    Open the results database, record one run and close it again.
+    """
+    with ResultsStore(db_path) as store:
+        return store.record_run(scenario, parameters, totals, input_files, summary, source)
@@ -0,0 +1,159 @@
+import os
+import numpy as np
+import pandas as pd
+
+# N-way comparison of scenario outputs. Each power CSV is turned into a
+# cumulative energy curve on its own time axis, then every curve is resampled
+# onto one shared grid with vectorized linear interpolation so scenarios with
+# integer and float time axes can be compared point by point. The grid only
+# spans the time every series covers, so each scenario's total is taken from
+# its own full series; differences, ratios and crossovers use the grid.
+
+DEFAULT_VOLTAGE = 3.3       # Operating voltage used by energyComparison.py
+DEFAULT_GRID_POINTS = 10000
+TIME_COLUMN = 'Time (s)'
+POWER_COLUMN = 'BLE Power (mA)'
+
+
+def _read_columns(file_path, columns):
+    try:
+        return pd.read_csv(file_path, usecols=columns, dtype=np.float64, encoding='utf-8')
+    except UnicodeDecodeError:
+        return pd.read_csv(file_path, usecols=columns, dtype=np.float64, encoding='ISO-8859-1')
+
+
+def load_series(file_path, time_column=TIME_COLUMN, power_column=POWER_COLUMN):
+    """
+    Load only the time and power columns of a power CSV as float64 arrays.
+    """
+    data = _read_columns(file_path, [time_column, power_column])
+    time_values = data[time_column].to_numpy()
+    power_values = data[power_column].to_numpy()
+
+    if np.any(np.diff(time_values) < 0):
+        order = np.argsort(time_values, kind='stable')
+        time_values, power_values = time_values[order], power_values[order]
+    return time_values, power_values
+
+
+def cumulative_energy(time_values, power_values, voltage=DEFAULT_VOLTAGE):
+    """
+    Vectorized form of calculate_cumulative_energy in energyComparison.py:
+    each interval is charged the power (mA) at its end.
+    """
+    energy = np.empty(len(time_values))
+    energy[0] = 0.0
+    np.cumsum((power_values[1:] / 1000) * voltage * np.diff(time_values), out=energy[1:])
+    return energy
+
+
+def common_grid(spans, points=DEFAULT_GRID_POINTS, step=None):
+    """
+    Shared time grid over the span covered by every series (latest start to
+    earliest end), with either a fixed number of points or a fixed step.
+    """
+    start = max(first for first, _ in spans)
+    stop = min(last for _, last in spans)
+    if stop <= start:
+        raise ValueError("Scenario time ranges do not overlap")
+    if step is not None:
+        return np.arange(start, stop + step / 2, step)
+    return np.linspace(start, stop, points)
+
+
+def resample_scenarios(file_paths, names=None, voltage=DEFAULT_VOLTAGE, points=DEFAULT_GRID_POINTS, step=None,
+                       time_column=TIME_COLUMN, power_column=POWER_COLUMN):
+    """
+    Load any number of scenario CSVs and resample their cumulative energy onto a
+    shared grid. Series are read twice (span, then values) so only one raw
+    series is in memory at a time next to the (scenarios x grid) result.
+
+    Returns the names, the grid, the resampled energies and each series' own
+    final cumulative energy.
+    """
+    if names is None:
+        names = [os.path.splitext(os.path.basename(path))[0] for path in file_paths]
+
+    spans = []
+    for path in file_paths:
+        time_values = _read_columns(path, [time_column])[time_column].to_numpy()
+        spans.append((time_values.min(), time_values.max()))
+    grid = common_grid(spans, points, step)
+
+    energies = np.empty((len(file_paths), len(grid)))
+    totals = np.empty(len(file_paths))
+    for i, path in enumerate(file_paths):
+        time_values, power_values = load_series(path, time_column, power_column)
+        energy = cumulative_energy(time_values, power_values, voltage)
+        energies[i] = np.interp(grid, time_values, energy)
+        totals[i] = energy[-1]
+    return names, grid, energies, totals
+
+
+def crossover_times(grid, difference):
+    """
+    Times at which a difference curve changes sign, linearly interpolated
+    between grid points.
+    """
+    sign = np.sign(difference)
+    # Carry the last nonzero sign over exact zeros so a touch is not a crossover
+    nonzero = np.flatnonzero(sign)
+    if len(nonzero) < 2:
+        return np.empty(0)
+    changes = nonzero[1:][sign[nonzero[1:]] != sign[nonzero[:-1]]]
+    before = nonzero[np.searchsorted(nonzero, changes) - 1]
+    d0, d1 = difference[before], difference[changes]
+    interpolated = grid[before] + (grid[changes] - grid[before]) * d0 / (d0 - d1)
+    # Curves that meet, run together and then part cross where they first meet
+    return np.where(changes - before > 1, grid[np.minimum(before + 1, len(grid) - 1)], interpolated)
+
+
+def compare_scenarios(names, grid, energies, totals=None):
+    """
+    Pairwise differences, ratios and crossover times between resampled scenarios.
+
+    Returns a dict with each series' total (its own final cumulative energy;
+    the end of the grid when totals are not given), the energies at the end of
+    the common grid, (N x N) difference and ratio matrices of those common-span
+    energies (row minus / over column) and, for each pair, the times at which
+    their cumulative energy curves cross.
+    """
+    common_totals = energies[:, -1]
+    totals = common_totals if totals is None else np.asarray(totals, dtype=np.float64)
+    difference = common_totals[:, None] - common_totals[None, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = common_totals[:, None] / common_totals[None, :]
+
+    # Pairs are compared one at a time so only one difference curve is alive
+    crossovers = {}
+    for i in range(len(names)):
+        for j in range(i + 1, len(names)):
+            crossovers[(names[i], names[j])] = crossover_times(grid, energies[i] - energies[j])
+
+    return {'names': list(names),
+            'grid': grid,
+            'totals': totals,
+            'common_totals': common_totals,
+            'difference': difference,
+            'ratio': ratio,
+            'crossovers': crossovers}
+
+
+def print_comparison(comparison):
+    """
+    Print totals, common-span ratios to the lowest-energy scenario and
+    crossover times.
+    """
+    names, totals, common_totals = comparison['names'], comparison['totals'], comparison['common_totals']
+    best = int(np.argmin(common_totals))
+    print(f"Common grid: {comparison['grid'][0]:.3f}s to {comparison['grid'][-1]:.3f}s "
+          f"({len(comparison['grid'])} points)")
+    for i, name in enumerate(names):
+        print(f"Total Cumulative Energy for {name}: {totals[i]:.6f} J")
+    for i, name in enumerate(names):
+        print(f"Over the common span, {name}: {common_totals[i]:.6f} J "
+              f"({comparison['ratio'][i, best]:.3f}x {names[best]}, "
+              f"{comparison['difference'][i, best]:+.6f} J)")
+    for (first, second), times in comparison['crossovers'].items():
+        if len(times):
+            print(f"{first} and {second} cross at: " + ', '.join(f"{t:.2f}s" for t in times))
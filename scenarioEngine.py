@@ -0,0 +1,293 @@
+import os
+import re
+import json
+import numpy as np
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# Declarative scenario definitions. A scenario file (JSON, or YAML when PyYAML is
+# installed) lists the log-pattern triggers, the state machines driven by them
+# (states, currents, transitions) and how BLE activity and fixed sleep phases
+# are charged. compile_scenario turns a definition into dense lookup tables that
+# replayKernel runs for both simulated events and recorded logs, so a new WuR
+# variant is a new file in scenarios/ rather than a new copy of the parser.
+#
+# Trigger, activity, packet and phase patterns are regular expressions searched in
+# the event description; packet patterns are case-insensitive.
+# Phases label each event with the protocol phase it belongs to (WuR listening,
+# advertising, GATT discovery, ...) for phaseEnergy's attribution; 'cached_discovery'
+# names the phase of a cached discovery and the phases of the full discovery it replaces.
+
+SCENARIO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scenarios')
+SCENARIO_EXTENSIONS = ('.json', '.yaml', '.yml')
+
+NO_TRIGGER = -1
+NO_TRANSITION = -1
+CLASSIFY_CACHE_SIZE = 8  # Encoder vocabularies whose classification tables are kept
+
+_compiled_cache = {}
+
+
+def scenario_path(name, directory=SCENARIO_DIR):
+    """
+    Path of a scenario file, given a path or a name in scenarios/ (or directory).
+    """
+    if os.path.isfile(name):
+        return name
+    for folder in dict.fromkeys((directory, SCENARIO_DIR)):
+        for extension in SCENARIO_EXTENSIONS:
+            path = os.path.join(folder, name + extension)
+            if os.path.isfile(path):
+                return path
+    raise ValueError(f"Unknown scenario {name!r}, expected one of {list_scenarios()} or a scenario file")
+
+
+def list_scenarios():
+    """
+    Names of the scenarios defined in scenarios/ (shared base files have no 'name').
+    """
+    names = []
+    for file_name in sorted(os.listdir(SCENARIO_DIR)):
+        name, extension = os.path.splitext(file_name)
+        if extension in SCENARIO_EXTENSIONS and (extension == '.json' or yaml is not None) \
+                and 'name' in _read_file(os.path.join(SCENARIO_DIR, file_name)):
+            names.append(name)
+    return names
+
+
+def _read_file(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        if path.endswith('.json'):
+            return json.load(file)
+        if yaml is None:
+            raise ValueError(f"PyYAML is required to read {path}")
+        return yaml.safe_load(file)
+
+
+def _merge(base, override):
+    # Nested mappings are merged key by key; anything else is replaced
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def load_definition(name, directory=SCENARIO_DIR, files=None):
+    """
+    Read a scenario definition, resolving 'extends' chains. Base files are
+    looked up next to the file that extends them, then in scenarios/. The path
+    of every file read is appended to files when given.
+    """
+    path = os.path.abspath(scenario_path(name, directory))
+    if files is not None:
+        files.append(path)
+    definition = _read_file(path)
+    base = definition.pop('extends', None)
+    if base is not None:
+        definition = _merge(load_definition(base, os.path.dirname(path), files), definition)
+    return definition
+
+
+class CompiledScenario:
+    """
+    Dense tables of a scenario definition. With M machines, S states (padded to
+    the largest machine) and T triggers:
+
+    next_state: (M * S * T) target state index, NO_TRANSITION to stay; a
+        transition to the current state re-enters it (restarts its entry time)
+    accumulate: (M * S) whether time spent in the state is totalled
+    record: (M * S) whether each stay in the state is recorded as a period
+    current: (M, S) current drawn in each state (A)
+    """
+
+    def __init__(self, definition):
+        self.definition = definition
+        self.name = definition['name']
+        self.model = definition.get('simulation', {}).get('model')
+        self.parameters = dict(definition.get('parameters', {}))
+        self.voltage = float(definition['voltage'])
+
+        self.trigger_names = [trigger['name'] for trigger in definition.get('triggers', [])]
+        self.trigger_patterns = [re.compile(trigger['pattern']) for trigger in definition.get('triggers', [])]
+        trigger_index = {name: i for i, name in enumerate(self.trigger_names)}
+        if len(trigger_index) != len(self.trigger_names):
+            raise ValueError(f"Scenario {self.name!r} defines a trigger name twice")
+
+        def lookup_trigger(name):
+            if name not in trigger_index:
+                raise ValueError(f"Scenario {self.name!r} has no trigger {name!r}")
+            return trigger_index[name]
+
+        machines = definition.get('machines', {})
+        self.machine_names = list(machines)
+        self.state_names = [list(machine['states']) for machine in machines.values()]
+        n_machines = len(machines)
+        n_states = max((len(states) for states in self.state_names), default=1)
+        n_triggers = max(len(self.trigger_names), 1)
+        self.shape = (n_machines, n_states, n_triggers)
+
+        next_state = np.full((n_machines, n_states, n_triggers), NO_TRANSITION, dtype=np.int64)
+        accumulate = np.zeros((n_machines, n_states), dtype=np.bool_)
+        record = np.zeros((n_machines, n_states), dtype=np.bool_)
+        self.current = np.zeros((n_machines, n_states))
+        self.initial = np.zeros(n_machines, dtype=np.int64)
+
+        for m, (machine_name, machine) in enumerate(machines.items()):
+            states = self.state_names[m]
+            state_index = {name: i for i, name in enumerate(states)}
+
+            def lookup_state(name):
+                if name not in state_index:
+                    raise ValueError(f"Machine {machine_name!r} of scenario {self.name!r} has no state {name!r}")
+                return state_index[name]
+
+            for s, (state_name, state) in enumerate(machine['states'].items()):
+                accumulate[m, s] = state.get('accumulate', True)
+                record[m, s] = state.get('record_periods', False)
+                self.current[m, s] = state.get('current', 0.0)
+            self.initial[m] = lookup_state(machine['initial'])
+
+            for transition in machine.get('transitions', []):
+                t = lookup_trigger(transition['trigger'])
+                target = lookup_state(transition['to'])
+                sources = [lookup_state(transition['from'])] if 'from' in transition else range(len(states))
+                for s in sources:
+                    next_state[m, s, t] = target
+
+        self.next_state = next_state.ravel()
+        self.accumulate = accumulate.ravel()
+        self.record = record.ravel()
+
+        activity = definition.get('ble_activity', {})
+        if activity.get('attribute_to', 'previous') not in ('previous', 'current'):
+            raise ValueError(f"ble_activity.attribute_to must be 'previous' or 'current' in scenario {self.name!r}")
+        self.attribute_to_current = activity.get('attribute_to') == 'current'
+        activities = activity.get('activities', [])
+        idle = activity.get('idle', {'name': 'idle', 'current': 0.0})
+        self.activity_names = [entry['name'] for entry in activities] + [idle['name']]
+        self.activity_patterns = [re.compile(entry['pattern']) for entry in activities]
+        self.activity_current = np.array([entry['current'] for entry in activities] + [idle['current']])
+        self.idle_activity = len(activities)
+
+        self.packet_patterns = [(re.compile(packet['pattern'], re.IGNORECASE), packet['length'])
+                                for packet in definition.get('packets', [])]
+        self.uncharged = [lookup_trigger(name) for name in definition.get('uncharged', [])]
+
+        phases = definition.get('phases', [])
+        self.phase_names = list(dict.fromkeys(phase['name'] for phase in phases))
+        self.phase_patterns = [(re.compile(phase['pattern']), self.phase_names.index(phase['name']))
+                               for phase in phases]
+        self.default_phase = len(self.phase_names)
+        self.phase_names.append(definition.get('default_phase', 'other'))
+        cached_discovery = definition.get('cached_discovery', {})
+        self.cached_discovery_phase = cached_discovery.get('phase')
+        self.replaced_phases = list(cached_discovery.get('replaces', []))
+        for phase in [self.cached_discovery_phase] + self.replaced_phases:
+            if phase is not None and phase not in self.phase_names:
+                raise ValueError(f"Scenario {self.name!r} has no phase {phase!r}")
+
+        self._classified = {}
+        self._tables = {}
+        self._phases = {}
+
+        fixed_sleep = definition.get('fixed_sleep')
+        if fixed_sleep:
+            self.fixed_sleep_trigger = lookup_trigger(fixed_sleep['trigger'])
+            self.fixed_sleep_duration = fixed_sleep['duration']
+            self.fixed_sleep_current = fixed_sleep['current']
+        else:
+            self.fixed_sleep_trigger = NO_TRIGGER
+            self.fixed_sleep_duration = 0
+            self.fixed_sleep_current = 0.0
+
+    def sleep_duration(self, sleep_duration=None):
+        """
+        Length of one fixed sleep phase; 'duration' may name a parameter.
+        """
+        if sleep_duration is not None:
+            return sleep_duration
+        if isinstance(self.fixed_sleep_duration, str):
+            return self.parameters[self.fixed_sleep_duration]
+        return self.fixed_sleep_duration
+
+    def classify(self, descriptions):
+        """
+        Per-description lookup tables: trigger index (first matching trigger,
+        NO_TRIGGER if none), BLE activity index, expected PDU length (0 for
+        non-packet events) and whether the event is left uncharged.
+        """
+        # Keyed by the encoder's description list, which only ever grows: rows
+        # are classified for the new descriptions and appended to its tables
+        key = id(descriptions)
+        if key not in self._tables or self._tables[key][0] is not descriptions:
+            if len(self._tables) >= CLASSIFY_CACHE_SIZE:
+                del self._tables[next(iter(self._tables))]
+            empty = np.empty(0, dtype=np.int64)
+            self._tables[key] = (descriptions, (empty, empty, empty, np.empty(0, dtype=np.bool_)))
+        tables = self._tables[key][1]
+        if len(tables[0]) < len(descriptions):
+            rows = [self._classify_description(description) for description in descriptions[len(tables[0]):]]
+            trigger, activity, length = (np.array(column, dtype=np.int64) for column in zip(*rows))
+            tables = tuple(np.concatenate(pair) for pair in zip(tables, (trigger, activity, length,
+                                                                         np.isin(trigger, self.uncharged))))
+            self._tables[key] = (descriptions, tables)
+        return tables
+
+    def phases(self, descriptions):
+        """
+        Phase index of every description: the phase of the first matching
+        pattern, or the default phase.
+        """
+        for description in descriptions:
+            if description not in self._phases:
+                self._phases[description] = next((phase for pattern, phase in self.phase_patterns
+                                                  if pattern.search(description)), self.default_phase)
+        return np.array([self._phases[description] for description in descriptions], dtype=np.int64)
+
+    def _classify_description(self, description):
+        if description not in self._classified:
+            self._classified[description] = (
+                next((t for t, pattern in enumerate(self.trigger_patterns) if pattern.search(description)),
+                     NO_TRIGGER),
+                next((a for a, pattern in enumerate(self.activity_patterns) if pattern.search(description)),
+                     self.idle_activity),
+                next((packet_length for pattern, packet_length in self.packet_patterns
+                      if pattern.search(description)), 0))
+        return self._classified[description]
+
+
+def compile_scenario(definition):
+    return CompiledScenario(definition)
+
+
+def _modified_times(files):
+    stamps = []
+    for path in files:
+        try:
+            stamps.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            stamps.append(None)
+    return tuple(stamps)
+
+
+def load_scenario(name):
+    """
+    Load and compile a scenario by name or path. Compiled scenarios are cached
+    until the file or any file it extends changes.
+    """
+    if isinstance(name, CompiledScenario):
+        return name
+    path = os.path.abspath(scenario_path(name))
+    cached = _compiled_cache.get(path)
+    if cached is None or _modified_times(cached[0]) != cached[1]:
+        files = []
+        definition = load_definition(path, files=files)
+        cached = (tuple(files), _modified_times(files), compile_scenario(definition))
+        _compiled_cache[path] = cached
+    return cached[2]
@@ -0,0 +1,449 @@
+import math
+from collections import deque, namedtuple
+import numpy as np
+
+from scenarioEngine import load_scenario
+
+# Python port of the event flow of alwaysOnWuR.m ('aow'), dutyCycled_WuR.m ('dcw')
+# and dutyCycledBLE.m ('dcb'). It writes the same state-log lines as the MATLAB
+# simulations, without the real-time pauses or the Bluetooth toolbox, so the
+# stochastic parts of a scenario can be studied over many runs.
+
+SCENARIOS = ('aow', 'dcw', 'dcb')
+
+SIMULATION_TIME_LIMIT = 20 * 60  # Simulated seconds per run
+
+DETECTION_THRESHOLD_MIN = 0.83  # threshold = 0.83 + (1 - 0.83) * rand()
+# P(rand() > threshold) with the threshold uniform on [0.83, 1]
+DETECTION_PROBABILITY = (1 - DETECTION_THRESHOLD_MIN) / 2
+
+ADVERTISING_INTERVAL = 1.285    # Duty-cycled BLE advertising interval (seconds)
+ADVERTISING_DURATION = 10       # Advertise for 10 seconds
+CONNECTION_PROBABILITY = 0.10   # Client connects when rand() > 0.90
+
+HEART_RATE_RANGE = (60, 180)    # randi([60 180])
+
+# Log descriptions, exactly as written by the MATLAB scripts
+CHECKING_SIGNAL = 'Wake-up radio is checking for a signal.'
+AWAKE_CHECKING_SIGNAL = 'Wake-up radio is awake and checking for a signal.'
+NO_SIGNAL = 'No wake-up signal detected.'
+WUR_BACK_TO_SLEEP = 'Wake-up radio is going back to sleep.'
+SIGNAL_DETECTED = 'Wake-up signal detected. WuR is active and processing the wake-up signal.'
+DEVICE_FORGOTTEN = 'Device forgotten, reconnection required.'
+BLE_AWAKE = 'BLE device is now awake and communicating.'
+BLE_WAKING_UP = 'BLE device is waking up to send heart rate measurement notification.'
+ADVERTISING_INDICATION = 'Implant (GATT Server) is transmitting advertising indication.'
+ADVERTISEMENT_INDICATION = 'Implant (GATT Server) is transmitting advertisement indication.'
+CONNECTION_INDICATION = 'Implant (GATT Server) is receiving connection indication.'
+USING_CACHE = 'Using cached discovery data (services, characteristics, descriptors).'
+HEART_RATE_NOTIFICATION = 'Implant (GATT Server) is transmitting heart rate measurement notification.'
+BLE_BACK_TO_SLEEP = 'Putting BLE device back to sleep...'
+BLE_BACK_TO_SLEEP_AFTER_NOTIFICATION = 'Putting BLE device back to sleep after notification.'
+
+# GATT discovery as (seconds elapsed before the line, description). A None
+# description is a silent step where the client decodes a response.
+GATT_DISCOVERY = [
+    (0, 'Implant (GATT Server) is receiving service discovery request.'),
+    (1, 'Implant (GATT Server) is transmitting service discovery.'),
+    (2, 'Implant (GATT Server) is receiving characteristic discovery request.'),
+    (1, 'Implant (GATT Server) is transmitting characteristic discovery.'),
+    (2, 'Implant (GATT Server) is receiving all available characteristic descriptors request.'),
+    (1, 'Implant (GATT Server) is transmitting characteristic descriptor discovery.'),
+    (1, 'Implant (GATT Server) is receiving enable notification request .'),
+    (1, 'Implant (GATT Server) is transmitting enable notifications response.'),
+    (1, None)
+]
+
+# A compressed stretch of idle seconds: `count` repetitions, `period` seconds
+# apart, of the cycle `lines` ((offset, description) pairs) from start_time
+IdleRun = namedtuple('IdleRun', ['start_time', 'period', 'count', 'lines'])
+
+# WuR scenarios advertise and connect right after waking, then run GATT discovery
+WUR_FULL_DISCOVERY = [(0, ADVERTISING_INDICATION), (1, CONNECTION_INDICATION)] + [
+    (elapsed + (1 if i == 0 else 0), description) for i, (elapsed, description) in enumerate(GATT_DISCOVERY)]
+
+
+def format_time(time_sec):
+    """
+    Format a time the way MATLAB's '%d' does: integers as-is, other values in %e.
+    """
+    if float(time_sec).is_integer():
+        return str(int(time_sec))
+    return f"{time_sec:e}"
+
+
+def format_event(time_sec, description):
+    return f"Time {format_time(time_sec)}s: {description}"
+
+
+def format_idle_run(run):
+    """
+    Compressed log lines for an idle run, one 'Times first:period:last' line per
+    line of the repeated cycle.
+    """
+    last_start = run.start_time + (run.count - 1) * run.period
+    return [f"Times {format_time(run.start_time + offset)}:{format_time(run.period)}:"
+            f"{format_time(last_start + offset)}s: {description}"
+            for offset, description in run.lines]
+
+
+def expand_events(events):
+    """
+    Yield plain (time, description) events, expanding compressed idle runs.
+    """
+    for item in events:
+        if isinstance(item, IdleRun):
+            for k in range(item.count):
+                for offset, description in item.lines:
+                    yield (item.start_time + k * item.period + offset, description)
+        else:
+            yield item
+
+
+def write_log(events, log_file_path):
+    """
+    Write simulated events in the state-log format read by parse_log_file.
+    Idle runs are written as compressed 'Times' lines, which read_log expands.
+    """
+    with open(log_file_path, 'w') as log_file:
+        for item in events:
+            if isinstance(item, IdleRun):
+                for line in format_idle_run(item):
+                    log_file.write(line + '\n')
+            else:
+                log_file.write(format_event(*item) + '\n')
+
+
+def _parse_time(text):
+    time_sec = float(text)
+    return int(time_sec) if time_sec.is_integer() else time_sec
+
+
+def iter_log(log_file_path):
+    """
+    Stream a state log as events, grouping consecutive compressed 'Times'
+    lines into IdleRun items.
+    """
+    with open(log_file_path, 'r') as file:
+        yield from iter_log_lines(file)
+
+
+def iter_log_lines(lines):
+    """
+    Parse state-log lines from any iterable of strings (see iter_log).
+    """
+    pending = []  # (first, period, last, description) of the current idle run
+
+    def idle_run():
+        first, period, last, _ = pending[0]
+        count = int(round((last - first) / period)) + 1
+        return IdleRun(first, period, count, tuple((line[0] - first, line[3]) for line in pending))
+
+    for line in lines:
+        line = line.strip()
+        try:
+            head, description = line.split(": ", 1)
+            if line.startswith("Times "):
+                first, period, last = (_parse_time(value) for value in head.split()[1].rstrip('s').split(':'))
+                if pending and (period, last - first) != (pending[0][1], pending[0][2] - pending[0][0]):
+                    yield idle_run()
+                    pending.clear()
+                pending.append((first, period, last, description.strip()))
+            elif line.startswith("Time "):
+                event = (_parse_time(head.split()[1].replace('s', '')), description.strip())
+                if pending:
+                    yield idle_run()
+                    pending.clear()
+                yield event
+        except (IndexError, ValueError):
+            continue
+    if pending:
+        yield idle_run()
+
+
+def read_log(log_file_path):
+    """
+    Read a state log back into a list of events (see iter_log).
+    """
+    return list(iter_log(log_file_path))
+
+
+# An idle cycle of a scenario: the lines it logs, its duration, the number of
+# reconnection checks and the success probabilities of its random draws in order
+_IdleCycle = namedtuple('_IdleCycle', ['lines', 'duration', 'trials', 'probabilities'])
+
+
+class _Simulation:
+    def __init__(self, scenario, rng, reconnection_probability, heart_rate_trace):
+        self.scenario = scenario
+        self.rng = rng
+        self.reconnection_probability = reconnection_probability
+        self.heart_rate_trace = heart_rate_trace
+        self.current_time = 0
+        self.cache_initialized = False
+        self.reconnection_required = False
+        self.events = []
+        self.heart_rates = []
+        self.wake_ups = 0
+        self.reconnections = 0
+        self.reconnection_trials = 0
+        self.forced = deque()     # Predetermined draw outcomes (fast-forward)
+        self.recording = None     # Draw probabilities of a dry run, or None
+        self.idle_cycle = None
+
+    def log(self, description):
+        self.events.append((self.current_time, description))
+
+    def bernoulli(self, probability):
+        if self.forced:
+            return self.forced.popleft()
+        if self.recording is not None:
+            self.recording.append(probability)
+            return False
+        return self.rng.random() < probability
+
+    def reconnection_trial(self):
+        if not self.reconnection_required:
+            self.reconnection_trials += 1
+            if self.bernoulli(self.reconnection_probability):
+                self.reconnection_required = True
+                self.reconnections += 1
+
+    def signal_detected(self):
+        return self.bernoulli(DETECTION_PROBABILITY)
+
+    def heart_rate(self):
+        if self.heart_rate_trace is None:
+            value = int(self.rng.integers(HEART_RATE_RANGE[0], HEART_RATE_RANGE[1] + 1))
+        else:
+            value = self.heart_rate_trace.value_at(self.current_time)
+        self.heart_rates.append((self.current_time, value))
+        return value
+
+    def run_steps(self, steps):
+        for elapsed, description in steps:
+            self.current_time += elapsed
+            if description is not None:
+                self.log(description)
+
+    def discover(self, steps):
+        """
+        Full discovery when the cache is empty or a reconnection is pending,
+        otherwise reuse the cached services, characteristics and descriptors.
+        """
+        if not self.cache_initialized or self.reconnection_required:
+            self.run_steps(steps)
+            self.cache_initialized = True
+            self.reconnection_required = False
+            return True
+        self.log(USING_CACHE)
+        return False
+
+    def wake_ble(self, notify_delay):
+        self.wake_ups += 1
+        self.current_time += 1
+        self.log(BLE_AWAKE)
+        self.discover(WUR_FULL_DISCOVERY)
+        self.current_time += notify_delay
+        self.log(HEART_RATE_NOTIFICATION)
+        self.heart_rate()
+        self.current_time += 1
+        self.log(BLE_BACK_TO_SLEEP)
+
+    def step_aow(self):
+        self.current_time += 1
+        self.log(CHECKING_SIGNAL)
+        self.reconnection_trial()
+        if self.signal_detected() or self.reconnection_required:
+            self.log(SIGNAL_DETECTED)
+            if self.reconnection_required:
+                self.log(DEVICE_FORGOTTEN)
+            self.wake_ble(notify_delay=1)
+
+    def step_dcw(self, wake_up_interval):
+        self.current_time += 1
+        self.reconnection_trial()
+        if self.current_time % wake_up_interval != 1 and not self.reconnection_required:
+            return
+
+        self.log(AWAKE_CHECKING_SIGNAL)
+        if self.reconnection_required:
+            self.current_time += 1
+            self.log(DEVICE_FORGOTTEN)
+
+        signal_detected = False
+        for _ in range(wake_up_interval):
+            if self.signal_detected() or self.reconnection_required:
+                signal_detected = True
+                self.log(SIGNAL_DETECTED)
+                self.wake_ble(notify_delay=0)
+                break
+            self.log(NO_SIGNAL)
+            self.current_time += 1
+
+        if not signal_detected:
+            self.log(WUR_BACK_TO_SLEEP)
+        self.current_time += 1
+
+    def run(self, step, time_limit, cycle_start=None):
+        """
+        Run loop iterations until the time limit. With a cycle_start predicate
+        (fast-forward mode), idle stretches starting at such iterations are
+        skipped in one step and logged as compressed IdleRun items.
+        """
+        while self.current_time < time_limit:
+            if cycle_start is not None and not self.forced and cycle_start():
+                self.fast_forward(step, cycle_start, time_limit)
+                if self.current_time >= time_limit:
+                    break
+            step()
+
+    def record_idle_cycle(self, step, cycle_start):
+        """
+        Dry-run one idle cycle with every draw failing, then roll back. Idle
+        cycles are identical up to a time shift, so this is done once per run.
+        """
+        start_time, start_events, start_trials = self.current_time, len(self.events), self.reconnection_trials
+        self.recording = []
+        step()
+        while not cycle_start():
+            step()
+        cycle = _IdleCycle(lines=tuple((time_sec - start_time, description)
+                                       for time_sec, description in self.events[start_events:]),
+                           duration=self.current_time - start_time,
+                           trials=self.reconnection_trials - start_trials,
+                           probabilities=np.array(self.recording))
+        self.recording = None
+        del self.events[start_events:]
+        self.current_time, self.reconnection_trials = start_time, start_trials
+        return cycle
+
+    def fast_forward(self, step, cycle_start, time_limit):
+        if self.idle_cycle is None:
+            self.idle_cycle = self.record_idle_cycle(step, cycle_start)
+        cycle = self.idle_cycle
+
+        # Every draw of an idle cycle fails, so the number of idle cycles before
+        # the next wake-up or reconnection is geometric
+        idle_probability = float(np.prod(1 - cycle.probabilities))
+        max_cycles = int((time_limit - self.current_time) // cycle.duration)
+        if idle_probability < 1:
+            idle_cycles = int(self.rng.geometric(1 - idle_probability)) - 1
+        else:
+            idle_cycles = max_cycles
+
+        skipped = min(idle_cycles, max_cycles)
+        if skipped > 0:
+            if cycle.lines:
+                self.events.append(IdleRun(self.current_time, cycle.duration, skipped, cycle.lines))
+            self.current_time += skipped * cycle.duration
+            self.reconnection_trials += skipped * cycle.trials
+        if idle_cycles >= max_cycles:
+            return  # The horizon ends within the next cycle: step it normally
+
+        # Condition the next cycle on at least one success: draw the index of
+        # the first successful draw and force the outcomes up to it
+        survival = np.concatenate(([1.0], np.cumprod(1 - cycle.probabilities)[:-1]))
+        first_success = survival * cycle.probabilities
+        index = int(self.rng.choice(len(first_success), p=first_success / first_success.sum()))
+        self.forced.extend([False] * index + [True])
+
+    def run_dcb(self, time_limit, sleep_duration):
+        advertising_attempts = math.ceil(ADVERTISING_DURATION / ADVERTISING_INTERVAL)
+        first_connection_established = False
+        while self.current_time < time_limit:
+            self.log(BLE_WAKING_UP)
+            self.current_time += 1
+
+            if not first_connection_established:
+                connected = False
+                for _ in range(advertising_attempts):
+                    self.log(ADVERTISEMENT_INDICATION)
+                    self.current_time += ADVERTISING_INTERVAL
+                    if self.bernoulli(CONNECTION_PROBABILITY):
+                        self.log(CONNECTION_INDICATION)
+                        self.current_time += 1
+                        connected = True
+                        break
+                if not connected:
+                    continue
+
+                self.wake_ups += 1
+                self.discover(GATT_DISCOVERY)
+                first_connection_established = True
+            else:
+                self.wake_ups += 1
+
+            self.log(HEART_RATE_NOTIFICATION)
+            self.heart_rate()
+            self.current_time += 1
+            self.log(BLE_BACK_TO_SLEEP_AFTER_NOTIFICATION)
+            self.current_time += sleep_duration
+
+
+def scenario_reconnection_probability(scenario):
+    """
+    Per-check reconnection probability of a scenario, its
+    'reconnection_probability' parameter (0 when it sets none).
+    """
+    definition = load_scenario(scenario)
+    if definition.model not in SCENARIOS:
+        raise ValueError(f"Scenario {scenario!r} has no simulation model, expected one of {SCENARIOS}")
+    return definition.parameters.get('reconnection_probability', 0.0)
+
+
+def _scenario_parameter(definition, name):
+    if name not in definition.parameters:
+        raise ValueError(f"Scenario {definition.name!r} sets no {name!r} parameter")
+    return definition.parameters[name]
+
+
+def simulate(scenario, time_limit=SIMULATION_TIME_LIMIT, seed=None, rng=None,
+             reconnection_probability=None, wake_up_interval=None,
+             sleep_duration=None, heart_rate_trace=None, fast_forward=False):
+    """
+    Simulate one run of a scenario and return its events and counters.
+
+    scenario names a definition in scenarios/ (or a scenario file); its
+    simulation model picks the event flow and its parameters fill in any
+    reconnection_probability, wake_up_interval or sleep_duration not given.
+
+    heart_rate_trace is an optional heartRateTrace.HeartRateTrace; without it
+    heart rates are drawn uniformly like randi([60 180]).
+
+    With fast_forward the time to the next wake-up or reconnection is sampled
+    directly, so the cost grows with the number of wake-ups rather than the
+    number of seconds; idle stretches appear in the events as IdleRun items
+    (see expand_events). The duty-cycled BLE scenario has no idle seconds to
+    skip and is simulated as usual.
+    """
+    definition = load_scenario(scenario)
+    model = definition.model
+    if model not in SCENARIOS:
+        raise ValueError(f"Scenario {scenario!r} has no simulation model, expected one of {SCENARIOS}")
+    if rng is None:
+        rng = np.random.default_rng(seed)
+    if reconnection_probability is None:
+        reconnection_probability = scenario_reconnection_probability(definition)
+    if wake_up_interval is None and model == 'dcw':
+        wake_up_interval = _scenario_parameter(definition, 'wake_up_interval')
+    if sleep_duration is None and model == 'dcb':
+        sleep_duration = _scenario_parameter(definition, 'sleep_duration')
+
+    simulation = _Simulation(model, rng, reconnection_probability, heart_rate_trace)
+    if model == 'aow':
+        simulation.run(simulation.step_aow, time_limit,
+                       cycle_start=(lambda: True) if fast_forward else None)
+    elif model == 'dcw':
+        simulation.run(lambda: simulation.step_dcw(wake_up_interval), time_limit,
+                       cycle_start=(lambda: simulation.current_time % wake_up_interval == 0) if fast_forward else None)
+    else:
+        simulation.run_dcb(time_limit, sleep_duration)
+
+    return {'scenario': scenario,
+            'events': simulation.events,
+            'heart_rates': simulation.heart_rates,
+            'duration': simulation.current_time,
+            'wake_ups': simulation.wake_ups,
+            'reconnections': simulation.reconnections,
+            'reconnection_trials': simulation.reconnection_trials}